@@ -0,0 +1,268 @@
+"""
+    An asyncio backend for the `TempoClock`. Instead of running a clock thread that hands
+    queue blocks to worker threads, an `AsyncTempoClock` runs its main loop as a coroutine
+    on an asyncio event loop and calls each block on that loop. In lookahead mode the OSC
+    bundles are sent by a coroutine as well, and `when` statements are evaluated by another
+    coroutine instead of their own thread. This makes it possible to run FoxDot inside an
+    asyncio application, such as a web or OSC service, without any extra threads:
+
+        import asyncio
+
+        from FoxDot.lib import update_foxdot_clock
+        from FoxDot.lib.AsyncTempoClock import AsyncTempoClock
+
+        async def main():
+            Clock.stop()
+            clock = AsyncTempoClock(loop=asyncio.get_running_loop())
+            update_foxdot_clock(clock)
+            ...
+
+    `schedule`, `future`, `every` etc. work the same as with a `TempoClock` and can be
+    called from the event loop or from any other thread. If no loop is given, the clock
+    starts one in a background thread when it is started.
+
+    Tempo sync using `TempoServer` and `TempoClient` still runs on its own threads, as it
+    only updates the clock using thread-safe methods such as `schedule`.
+
+    Requires Python 3.7 or higher.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import asyncio
+import threading
+
+from traceback import format_exc as error_stack
+
+from .TempoClock import TempoClock, BundleSender
+from .Code import when, WarningMsg
+
+class AsyncTempoClock(TempoClock):
+    """ A `TempoClock` that runs on the asyncio event loop `loop` """
+
+    def __init__(self, bpm=120.0, meter=(4,4), loop=None):
+
+        self.loop = loop
+        self.loop_thread = None
+
+        # The running main loop and when statement coroutines, and the event used to wake the main loop
+        self.task = None
+        self.when_task = None
+        self.wake_event = None
+
+        TempoClock.__init__(self, bpm, meter)
+
+        self.sender = AsyncBundleSender(self)
+
+        # Start the main loop when the first item is scheduled
+        self.ticking = False
+
+    def in_loop(self):
+        """ Returns True if called from the clock's event loop """
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def spawn(self, coro):
+        """ Runs a coroutine on the clock's event loop from any thread and returns its task or future """
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+            self.loop_thread = threading.Thread(target=self.loop.run_forever)
+            self.loop_thread.daemon = True
+            self.loop_thread.start()
+        if self.in_loop():
+            return self.loop.create_task(coro)
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def call_soon(self, func, *args):
+        """ Calls `func` on the clock's event loop from any thread """
+        if self.in_loop():
+            func(*args)
+        elif self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(func, *args)
+        return
+
+    def start(self):
+        """ Starts the main loop coroutine, and the sending coroutine in lookahead mode """
+        if self.lookahead > 0:
+            self.sender.start()
+        if (self.task is not None and not self.task.done()) or self.time_source.manual:
+            return
+        self.ticking = True
+        self.task = self.spawn(self.run())
+        when.runner = self.start_when_statements
+        if len(when) > 0:
+            self.start_when_statements()
+        return
+
+    def stop(self):
+        TempoClock.stop(self)
+        self.notify()
+        if self.task is not None:
+            self.call_soon(self.task.cancel)
+        if when.runner == self.start_when_statements:
+            when.runner = None
+        return
+
+    def notify(self):
+        """ Wakes the main loop so that it re-calculates when the next block is due """
+        if self.wake_event is not None:
+            self.call_soon(self.wake_event.set)
+        return
+
+    def set_workers(self, n):
+        """ Queue blocks are called on the event loop so worker threads are not used """
+        WarningMsg("AsyncTempoClock calls queue blocks on the event loop and does not use worker threads")
+        return
+
+    async def run(self):
+        """ Main loop """
+
+        self.ticking = True
+
+        self.wake_event = asyncio.Event()
+
+        while self.ticking:
+
+            beat = self._now() # get current time
+
+            if self.next_event() <= beat + self.get_lookahead():
+
+                self.current_block = self.pop_block()
+
+                if len(self.current_block):
+
+                    self.loop_stats.add_wake_error(self.get_time() + self.lookahead - self.get_time_at_beat(self.current_block.beat))
+
+                    if self.handle_late_block(self.current_block, beat):
+
+                        self.call_block(self.current_block, beat)
+
+            # If using a midi-clock, update the values
+
+            if self.midi_clock is not None:
+
+                self.midi_clock.update()
+
+            await self.wait_for_next_block()
+
+            self.loop_stats.tick()
+
+        return
+
+    def call_block(self, block, beat):
+        """ Calls the items in a queue block on the event loop """
+        try:
+            self._TempoClock__run_block(block, beat, self.get_machine_time())
+        except:
+            print(error_stack())
+        return
+
+    async def wait_for_next_block(self):
+        """ Waits until the next block in the queue is due without blocking the event loop """
+
+        if self.polling or self.midi_clock is not None:
+
+            await asyncio.sleep(self.sleep_time)
+
+            return
+
+        # Clear the event first so a notify while calculating the deadline is not missed
+
+        self.wake_event.clear()
+
+        deadline  = self.get_time_at_beat(self.next_event()) - self.lookahead
+        remaining = deadline - self.get_time()
+
+        if remaining > self.spin_time:
+
+            try:
+
+                await asyncio.wait_for(self.wake_event.wait(), min(remaining - self.spin_time, self.max_sleep_time))
+
+            except asyncio.TimeoutError:
+
+                pass
+
+            return
+
+        # Close to the deadline: let other tasks run until it has passed
+
+        while self.ticking and self.get_time() < deadline:
+
+            await asyncio.sleep(0)
+
+        return
+
+    def start_when_statements(self):
+        """ Starts evaluating `when` statements on the event loop """
+        if self.when_task is None or self.when_task.done():
+            self.when_task = self.spawn(self.run_when_statements())
+        return
+
+    async def run_when_statements(self, interval=0.01):
+        """ Evaluates each `when` statement every `interval` seconds until there are none left """
+        while len(when) > 0:
+            when.evaluate()
+            await asyncio.sleep(interval)
+        return
+
+class AsyncBundleSender(BundleSender):
+    """ Sends the OSC bundles held in lookahead mode from a coroutine on the
+        clock's event loop instead of a thread """
+    def __init__(self, metro):
+        BundleSender.__init__(self, metro)
+        self.task  = None
+        self.event = None
+
+    def start(self):
+        """ Starts the sending coroutine if it is not already running """
+        with self.wake:
+            if self.running and self.task is not None and not self.task.done():
+                return
+            self.running = True
+            self.generation += 1
+            generation = self.generation
+        self.notify()
+        self.task = self.metro.spawn(self.run(generation))
+        return
+
+    def stop(self):
+        BundleSender.stop(self)
+        self.notify()
+        return
+
+    def notify(self):
+        if self.event is not None:
+            self.metro.call_soon(self.event.set)
+        return
+
+    def add(self, bundle, source=None):
+        BundleSender.add(self, bundle, source)
+        self.notify()
+        return
+
+    async def run(self, generation=0):
+        """ Sends each bundle when it is due """
+        self.event = asyncio.Event()
+        while True:
+            self.event.clear()
+            with self.wake:
+                if not self.running or self.generation != generation:
+                    break
+                if len(self.heap) == 0:
+                    remaining = None
+                else:
+                    now = self.metro.get_machine_time()
+                    remaining = self.heap[0][0] - now
+                    if remaining <= 0:
+                        bundles = self.pop_due(now)
+            if remaining is None or remaining > 0:
+                try:
+                    await asyncio.wait_for(self.event.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self.send(bundles)
+        return
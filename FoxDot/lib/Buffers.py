@@ -246,6 +246,10 @@ class BufferManager(object):
         """ Get buffer information from the buffer number """
         return self._buffers[bufnum]
 
+    def getLoadedBuffers(self):
+        """ Returns a list of all the buffers that have been loaded """
+        return [buf for buf in self._buffers if buf is not None]
+
     def _allocateAndLoad(self, filename, force=False):
         """ Allocates and loads a buffer from a filename, with caching """
         if filename not in self._fn_to_buf:
@@ -145,8 +145,11 @@ class _whenLibrary:
     def __init__(self):
         self.library = {}
         self.editing = None
+        self.runner  = None # if set, called instead of starting a thread
         
     def start_thread(self):
+        if self.runner is not None:
+            return self.runner()
         self.thread = Thread(target=self.run)
         self.thread.daemon = True
         self.thread.start()
@@ -165,18 +168,25 @@ class _whenLibrary:
         """ Continual loop evaluating when_statements
         """
         while len(self.library) > 0:
-            
-            for name, expression in self.library.items():
 
-                if expression.remove_me == True:
+            self.evaluate()
 
-                    del self.library[name]
+            sleep(0.01)
 
-                else:
+        return
 
-                    expression.evaluate()
+    def evaluate(self):
+        """ Evaluates each when_statement once, removing any that have been stopped
+        """
+        for name, expression in list(self.library.items()):
 
-            sleep(0.01)
+            if expression.remove_me == True:
+
+                del self.library[name]
+
+            else:
+
+                expression.evaluate()
 
         return
         
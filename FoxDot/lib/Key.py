@@ -21,7 +21,11 @@ def convert_pattern_args(func):
         if isinstance(value, (metaPattern, GeneratorPattern)):
             other_op = get_inverse_op(func.__name__)
             return getattr(value, other_op).__call__(self)
-        return func(self, value)
+        new = func(self, value)
+        # Keep track of the other value so that its changes are included in the stamp
+        if isinstance(new, NumberKey):
+            new.operands = (value,)
+        return new
     return new_method
 
 
@@ -34,10 +38,17 @@ class NumberKey(object):
         `p1.degree.value.parent == p2`.
     """
 
+    version = 0 # incremented when the value of a root key changes
+
+    operands = () # other values used by `calculate` e.g. `b` in `a > b`
+
     def __init__(self, value=0, function=None):
         # the number to store/update
         self.value     = value
         self.calculate = function if function is not None else lambda x: x
+        # the root key's version when the value was last calculated, and that value
+        self.stamp  = None
+        self.cached = None
         # reference to another number key that this is linked to
         # self.other = reference
         # self.parent = self.value if isinstance(self.value, NumberKey) else None
@@ -340,13 +351,49 @@ class NumberKey(object):
 
     def spawn_child(self, function):
         return self.__class__(self, function)
+
+    def refresh(self):
+        """ Called before the value of a root key is used """
+        return
+
+    def get_stamp(self):
+        """ Returns the ids and versions of the root keys this key depends on, including those
+            of any keys it was combined with, which change when the value of this key needs to
+            be calculated again. Returns None if a value it depends on varies over time """
+        root = self.get_root()
+        root.refresh()
+        if hasattr(root.value, "now"):
+            return None
+        stamp = [id(root), root.version]
+        key = self
+        while key is not None:
+            for operand in key.operands:
+                if isinstance(operand, NumberKey):
+                    other = operand.get_stamp()
+                    if other is None:
+                        return None
+                    stamp.append(other)
+                elif operand is not None and not isinstance(operand, (int, float, str)):
+                    return None
+            key = key.parent()
+        return tuple(stamp)
     
     def now(self, other=None):
-        """ Returns the current value in the Key by calling the parent """
+        """ Returns the current value in the Key by calling the parent. The value is
+            stored until the value of the root key it depends on changes """
+
+        stamp = self.get_stamp()
+
+        if stamp is not None and stamp == self.stamp:
+
+            return self.cached
 
         value = self.value.now() if hasattr(self.value, "now") else self.value
 
-        return self.calculate(value)
+        self.cached = self.calculate(value)
+        self.stamp  = stamp
+
+        return self.cached
 
 class PlayerKey(NumberKey):
     # def __init__(self, value=None, reference=None, parent=None, attr=None):
@@ -378,8 +425,15 @@ class PlayerKey(NumberKey):
     def name(self):
         return "{}.{}".format(self.player.id, self.attr)
 
+    def refresh(self):
+        """ Applies any updates from the player's delayed events that are now due """
+        if self.player is not None and len(self.player.key_timeline) > 0:
+            self.player.apply_key_timeline()
+        return
+
     def set(self, value, time):
         self.value = value
+        self.version += 1
         self.last_updated = time
         return
     
@@ -395,6 +449,7 @@ class PlayerKey(NumberKey):
                     self.value = PGroup(self.value, value)
             else:
                 self.value = value
+            self.version += 1
         self.last_updated = time
         return
 
@@ -85,6 +85,7 @@ class metaPattern(object):
     bracket_style = "[]"
     debugging = False
     meta = []
+    version = 0 # incremented when the pattern is changed in place
 
     def __init__(self, *args):
 
@@ -239,6 +240,7 @@ class metaPattern(object):
         return val
     
     def __setitem__(self, key, value):
+        self.version += 1
         if isinstance(key, slice):
             self.data[key] = Format(value) # TODO - make sure this works
         else:
@@ -255,6 +257,7 @@ class metaPattern(object):
 
     def setitem(self, key, value):
         self.data[key] = Format(value)
+        self.version += 1
             
     def __iter__(self):
         """ Returns a generator object for this Pattern """
@@ -281,6 +284,7 @@ class metaPattern(object):
     def __setslice__(self, i, j, item):
         """ Only works in Python 2 - maybe get rid? """
         self.data[i:j] = Format(item)
+        self.version += 1
 
     # Integer returning
     
@@ -830,31 +834,38 @@ class metaPattern(object):
     def extend(self, seq):
         """ Should return None """
         self.data.extend(map(convert_nested_data, seq))
+        self.version += 1
         return
 
     def append(self, item):
         """ Converts a new item to PGroup etc and appends """
         self.data.append(convert_nested_data(item))
+        self.version += 1
         return
     
     def i_rotate(self, n=1):
         self.data = self.data[n:] + self.data[0:n]
+        self.version += 1
         return self
 
     def i_reverse(self):
         self.data.reverse()
+        self.version += 1
         return self
 
     def i_sort(self):
         self.data = Pattern(sorted(self.data))
+        self.version += 1
         return self
 
     def i_shuf(self):
         shuffle(self.data)
+        self.version += 1
         return self
 
     def set(self, index, value):
         self.data[index] = asStream(value)
+        self.version += 1
         return self
 
     # Boolean tests
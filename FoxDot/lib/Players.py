@@ -104,6 +104,20 @@
 
         d1 >> play("x-o{-[--]o[-o]}")
 
+    Previewing events
+    -----------------
+
+    The notes a player is going to play can be calculated without sending them
+    to SuperCollider, which is useful for testing, exporting, or drawing them.
+    Each note is a dictionary with the beat it is played on and the values of
+    the player's attributes, including its frequency. ::
+
+        # The notes in the next 4 events
+        p1.events(4)
+
+        # The notes in the next 8 beats
+        p1.render(8)
+
     FoxDot Player Object Keywords
     -----------------------------
 
@@ -125,6 +139,8 @@
 from __future__ import absolute_import, division, print_function
 
 import itertools
+import bisect
+import heapq
 from functools import partial
 
 from os.path import dirname
@@ -148,6 +164,7 @@ from .Scale import Scale, ScaleType, ScalePattern
 from .Scale import midi, miditofreq, get_freq_and_midi
 
 from .Bang import Bang
+from .ServerManager import OSCBundle, OSCMessage
 
 from .TimeVar import TimeVar, Pvar
 
@@ -182,6 +199,96 @@ class EmptyPlayer(object):
                 return self.__getattr__(name) # use getattr to make sure we return player key
 
 
+class PlayerAttributes(dict):
+    """ Dictionary of a Player's attribute patterns. Only attributes that have been
+        changed are stored in the dictionary itself and the rest are looked up in
+        `defaults`, which is shared by all Players using the same SynthDef. Counts how
+        many times it has been changed in `version` so that the Player knows when to
+        compile its event table """
+    def __init__(self, defaults=None):
+        dict.__init__(self)
+        self.defaults = {} if defaults is None else defaults
+        self.version = 0
+
+    def set_defaults(self, defaults):
+        """ Uses a new table of defaults and removes any changes to the attributes in it """
+        self.defaults = defaults
+        for key in [key for key in dict.keys(self) if key in defaults]:
+            dict.__delitem__(self, key)
+        self.version += 1
+
+    def changed(self):
+        """ Returns the names of attributes that are not using their default """
+        return list(dict.keys(self))
+
+    def own(self, key):
+        """ Returns the Player's own pattern for an attribute so that it can be changed in
+            place, first copying it if it is the default that is shared with other Players """
+        if not dict.__contains__(self, key) and key in self.defaults:
+            dict.__setitem__(self, key, self.defaults[key].copy())
+        self.version += 1
+        return self[key]
+
+    def __missing__(self, key):
+        return self.defaults[key]
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self.defaults
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def keys(self):
+        """ Returns the names of all the attributes, default ones first """
+        return list(self.defaults) + [key for key in dict.keys(self) if key not in self.defaults]
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def copy(self):
+        return dict(self.items())
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self.version += 1
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.version += 1
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self.version += 1
+
+    def pop(self, *args):
+        self.version += 1
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self.version += 1
+        return dict.popitem(self)
+
+    def setdefault(self, key, value=None):
+        self.version += 1
+        return dict.setdefault(self, key, value)
+
+    def clear(self):
+        dict.clear(self)
+        self.version += 1
+
+
 class Player(Repeatable):
 
     """
@@ -215,7 +322,7 @@ class Player(Repeatable):
 
     debug = 0
 
-    __vars = []
+    __vars = set()
     __init = False
 
     # Really need to tidy this up
@@ -253,6 +360,12 @@ class Player(Repeatable):
 
     after_update_methods = ["stutter"]
 
+    # Tables of default attribute patterns shared by players, see `get_default_attributes`
+    default_attributes = {}
+
+    # Sets of internal variable names shared by players
+    internal_vars = {}
+
     # Tkinter Window
     widget = None
 
@@ -312,13 +425,28 @@ class Player(Repeatable):
         self.current_dur = None
         self.old_pattern_dur = None
         self.old_dur = None
+
+        # The rhythm last counted, its durations, and their running totals, see `count`
+        self.count_table = None
+
+        # The dur pattern and its version when the rhythm was last calculated, see `dur_updated`
+        self.dur_stamp = None
         
         self.isplaying = False
         self.isAlive = True
 
+        # Flagged when events built ahead of time need re-building
+
+        self.lookahead_dirty = False
+
+        # Attribute values that are the same for every event, and the names of those
+        # that aren't, see `compile_event_table`
+
+        self.event_table = None
+
         # These dicts contain the attribute and modifier values that are sent to SuperCollider     
 
-        self.attr  = {}
+        self.attr  = PlayerAttributes()
         self.modifier = Pattern()
         self.mod_data = 0
         self.filename = None
@@ -328,10 +456,28 @@ class Player(Repeatable):
         self.scale = None
         self.offset  = 0
         self.following = None
+
+        # PlayerKey objects for attributes that have been accessed e.g. `p1.degree`. These
+        # are kept out of the instance dict so that only user-facing lookups reach `__getattr__`
+
+        self.player_keys = {}
+
+        # Updates to the player keys from events with a delay, stored as a heap of (time, n, event,
+        # ignore, kwargs) until they are due, see `update_player_key_from_event`
+
+        self.key_timeline = []
+        self.key_timeline_n = 0
+
+        # The most notes this player can have playing at once, see `Clock.set_voice_limit`
+
+        self.max_voices = None
         
-        # List the internal variables we don't want to send to SuperCollider
+        # List the internal variables we don't want to send to SuperCollider. Players with
+        # the same internal variables share the set
+
+        internal = frozenset(self.__dict__.keys())
 
-        self.__vars = list(self.__dict__.keys())
+        self.__vars = Player.internal_vars.setdefault(internal, internal)
         self.__init = True
 
         self.reset()
@@ -479,14 +625,16 @@ class Player(Repeatable):
 
                 # Update any playerkey
 
-                if name in self.__dict__:
+                if name in self.player_keys:
 
-                    if isinstance(self.__dict__[name], PlayerKey):
-
-                        self.__dict__[name].update_pattern()
+                    self.player_keys[name].update_pattern()
 
                 # self.update_player_key(name, 0, 0)
 
+                # Re-build any events built ahead of time using the old value
+
+                self.refresh_lookahead()
+
                 return
             
         self.__dict__[name] = value
@@ -494,21 +642,23 @@ class Player(Repeatable):
         return
 
     def __getattr__(self, name):
+        """ Only called when `name` is not an internal variable or method, so returns a
+            PlayerKey for one of the player's attributes and keeps track of which are accessed """
         try:
             # This checks for aliases, not the actual keys
             name = self.alias.get(name, name)
 
-            if name in self.attr and name not in self.__dict__:
+            if name in self.attr and name not in self.player_keys:
 
                 # Return a Player key
 
                 self.update_player_key(name, self.now(name), 0)
 
-            item = self.__dict__[name]
+            item = self.player_keys[name]
 
-            # If returning a player key, keep track of which are being accessed
+            # Keep track of which player keys are being accessed
         
-            if isinstance(item, PlayerKey) and name not in self.accessed_keys:                
+            if name not in self.accessed_keys:
         
                 self.accessed_keys.append(name)
             
@@ -522,19 +672,10 @@ class Player(Repeatable):
 
         return
 
-    def __getattribute__(self, name):
-        # This checks for aliases, not the actual keys
-        name = Player.alias.get(name, name)
-        item = object.__getattribute__(self, name)
-        if isinstance(item, PlayerKey):
-            if name not in self.accessed_keys:
-                self.accessed_keys.append(name)
-        return item
-
     def __getitem__(self, name):
         if self.__init:
             if name not in self.__vars:
-                return self.attr[name]
+                return self.attr.own(name)
             pass
         return self.__dict__[name]
 
@@ -546,74 +687,104 @@ class Player(Repeatable):
 
     # --- Startup methods
 
-    def reset(self):
-        """ Sets all Player attributes to 0 unless their default is specified by an effect. Also
-            can be called by using a tilde before the player variable. E.g. ~p1 """
+    def get_default_attributes(self):
+        """ Returns the table of default attribute patterns for the player's SynthDef,
+            which is shared by all players using it """
+
+        if self.synthdef in SynthDefs:
+
+            synth = SynthDefs[self.synthdef]
 
-        # Add all keywords to the dict, then set non-zero defaults
+            envelope = tuple(synth.defaults[key] for key in ("atk", "decay", "rel"))
 
-        reset = []
+        else:
 
-        for key in Player.Attributes():
+            envelope = None
 
-            if key not in ("scale", "dur", "sus", "blur", "amp",
-                            "amplify", "degree", "oct", "bpm"):
+        key = (self.synthdef, envelope)
 
-                setattr(self, key, 0)
+        if key not in Player.default_attributes:
 
-            reset.append(key)
+            table = {}
 
-        # Set any non zero defaults for effects, e.g. verb=0.25
+            # Add all keywords to the dict, then set non-zero defaults
 
-        for key in Player.fx_attributes:
+            for attr in Player.Attributes():
 
-            value = FxList.defaults[key]
+                if attr not in ("scale", "dur", "sus", "blur", "amp",
+                                "amplify", "degree", "oct", "bpm"):
 
-            setattr(self, key, value)
+                    table[attr] = asStream(0)
 
-            reset.append(key)
+            # Set any non zero defaults for effects, e.g. verb=0.25
 
-        # Set SynthDef defaults
+            for attr in Player.fx_attributes:
 
-        if self.synthdef in SynthDefs:
+                table[attr] = asStream(FxList.defaults[attr])
 
-            synth = SynthDefs[self.synthdef]
-            
-            for key in ("atk", "decay", "rel"):
+            # Set any non-zero values for FoxDot
+
+            table["sus"]     = asStream(0.5 if self.synthdef == SamplePlayer else 1)
+            table["blur"]    = asStream(1)
+            table["amp"]     = asStream(1)
+            table["amplify"] = asStream(1)
+            table["dur"]     = asStream(0.5 if self.synthdef == SamplePlayer else 1)
+            table["degree"]  = asStream(" " if self.synthdef is SamplePlayer else 0)
+            table["oct"]     = asStream(5)
+            table["bpm"]     = asStream(None)
+
+            # Set SynthDef defaults
+
+            if envelope is not None:
+
+                for attr, value in zip(("atk", "decay", "rel"), envelope):
 
-                setattr(self, key, synth.defaults[key])
+                    table[attr] = asStream(value)
 
-                reset.append(key)
+            Player.default_attributes[key] = table
+
+        return Player.default_attributes[key]
+
+    def reset(self):
+        """ Sets all Player attributes to 0 unless their default is specified by an effect. Also
+            can be called by using a tilde before the player variable. E.g. ~p1 """
+
+        # Go back to the shared defaults for the SynthDef instead of setting each attribute
+
+        defaults = self.get_default_attributes()
+
+        self.attr.set_defaults(defaults)
 
         # Any other attribute that might have been used - set to 0
 
-        for key in self.attr:
+        for key in self.attr.changed():
 
-            if key not in reset:
+            setattr(self, key, 0)
 
-                setattr(self, key, 0)
+        # Use the defaults as the root of any pattern methods. The degree is always
+        # stored as it is used by `shuffle` and `rotate`
 
-        # Set any non-zero values for FoxDot
+        for key in set(self.previous_patterns) | set(["degree"]):
 
-        # Sustain & Legato
-        self.sus     = 0.5 if self.synthdef == SamplePlayer else 1
-        self.blur    = 1
+            if key not in defaults:
 
-        # Amplitude
-        self.amp     = 1
-        self.amplify = 1
+                continue
 
-        # Duration of notes
-        self.dur     = 0.5 if self.synthdef == SamplePlayer else 1
+            if key in self.previous_patterns and len(self.previous_patterns[key].list_of_methods) == 0:
 
-        # Degree of scale / Characters of samples
-        self.degree  = " " if self.synthdef is SamplePlayer else 0
+                self.previous_patterns[key].set_root_pattern(defaults[key])
 
-        # Octave of the note
-        self.oct     = 5
-        
-        # Tempo
-        self.bpm     = None
+            else:
+
+                self.update_pattern_root(key)
+
+        self.modifier = self.attr["sample" if self.synthdef == SamplePlayer else "degree"]
+
+        for key in self.player_keys:
+
+            self.player_keys[key].update_pattern()
+
+        self.refresh_lookahead()
 
         # Stop calling any repeating methods
 
@@ -712,15 +883,31 @@ class Player(Repeatable):
 
             self.current_dur = self.rhythm()
 
-        durations = list(map(get_first_item, self.current_dur)) # careful here
-        
-        total_dur = float(sum(durations))
+        # Running totals of the durations are stored until the rhythm changes, which
+        # replaces `current_dur` with a new list
+
+        table = self.count_table
+
+        if table is None or table[0] is not self.current_dur:
+
+            durations = list(map(get_first_item, self.current_dur)) # careful here
+
+            total_durations = []
+
+            for dur in durations:
+
+                total_durations.append(float(dur) + (total_durations[-1] if total_durations else 0))
+
+            table = self.count_table = (self.current_dur, durations, total_durations, float(sum(durations)))
+
+        rhythm, durations, total_durations, total_dur = table
 
         if total_dur == 0:
 
             WarningMsg("Player object has a total duration of 0. Set to 1")
 
             durations = [1]
+            total_durations = [1.0]
             total_dur =  1 
             self.dur  =  1
     
@@ -728,7 +915,7 @@ class Player(Repeatable):
 
         try:
 
-            n = int(len(durations) * (acc / total_dur))
+            n = len(durations) * int(round(acc / total_dur))
 
         except TypeError as e:
 
@@ -738,46 +925,87 @@ class Player(Repeatable):
 
             return 0, 0
 
+        # Find the event in the current cycle that contains `now`
+
         if acc != now:
 
-            while True:
+            offset = now - acc
 
-                dur = float(modi(durations, n))
+            i = bisect.bisect_left(total_durations, offset)
 
-                if acc + dur == now:
+            # Allow for rounding errors if an event starts at `now`
 
-                    acc += dur
+            if i > 0 and offset - total_durations[i - 1] < 1e-9:
 
-                    n += 1
+                i -= 1
 
-                    break
+            i = min(i, len(durations) - 1)
 
-                elif acc + dur > now:
+            if abs(total_durations[i] - offset) < 1e-9:
 
-                    if event_after:
+                acc  = now
+                n   += i + 1
 
-                        acc += dur
-                        n += 1
+            elif event_after:
 
-                    break
+                acc += total_durations[i]
+                n   += i + 1
 
-                else:
-                    
-                    acc += dur
-                    n += 1
+            elif i > 0:
+
+                acc += total_durations[i - 1]
+                n   += i
 
         # Returns value for self.event_n and self.event_index
 
         return n, acc
 
     def dur_updated(self):
-        """ Returns True if the players duration has changed since the last call """
-        self.current_dur = self.rhythm()
-        if self.current_dur != self.old_dur:
-            self.old_dur = self.current_dur
+        """ Returns True if the players duration has changed since the last call. The rhythm is
+            only calculated again if the dur pattern, or a pattern nested in it, has been changed
+            or replaced, or if it contains values that vary over time such as TimeVars,
+            generators, or PlayerKeys """
+
+        pattern = self.attr["dur"]
+        stamp = self.dur_stamp
+
+        if stamp is None or stamp[0] is not pattern or any(item.version != version for item, version in stamp[1]):
+
+            versions = [(item, item.version) for item in self.get_patterns(pattern)]
+
+            self.dur_stamp = (pattern, versions, self.is_time_varying(pattern))
+
+        elif not stamp[2]:
+
+            return False
+
+        rhythm = self.rhythm()
+        if rhythm != self.old_dur:
+            self.current_dur = self.old_dur = rhythm
             return True
         return False
 
+    @staticmethod
+    def get_patterns(value):
+        """ Returns a list of `value` and the patterns nested in it if it is a pattern """
+        patterns, stack = [], [value]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, metaPattern):
+                patterns.append(item)
+                stack.extend(item.data)
+        return patterns
+
+    @staticmethod
+    def is_time_varying(value):
+        """ Returns True if `value` is not a number, or a pattern or group of numbers,
+            and so could have a different value each time it is used """
+        if isinstance(value, (int, float, rest, EmptyItem)):
+            return False
+        if isinstance(value, metaPattern):
+            return any(Player.is_time_varying(item) for item in value.data)
+        return True
+
     def rhythm(self):
         """ Returns the players array of durations at this point in time """
         return list(map(lambda x: x if isinstance(x, (int, float)) else self.unpack(x), self.attr["dur"]))
@@ -896,8 +1124,53 @@ class Player(Repeatable):
 
             self.metro.schedule(self, self.event_index)
 
+        else:
+
+            self.refresh_lookahead()
+
         return self
 
+    def refresh_lookahead(self):
+        """ If the clock is building events ahead of time, makes sure that any this
+            player has built but not sent yet are re-built with its new attributes.
+            Changes made by items in the clock don't affect events already built. """
+
+        if self.metro is None or self.metro.lookahead == 0 or self.isplaying is False:
+
+            return
+
+        if self.lookahead_dirty is False and not self.metro.is_rendering():
+
+            self.lookahead_dirty = True
+
+            self.metro.schedule(self.rebuild_lookahead, self.metro.now(), is_priority=True)
+
+        return
+
+    def rebuild_lookahead(self):
+        """ Cancels events built ahead of time that haven't been sent and re-schedules
+            the player from the earliest of them """
+
+        self.lookahead_dirty = False
+
+        earliest = self.metro.sender.cancel(self)
+
+        if earliest is not None:
+
+            # Make sure the player isn't called at its previously scheduled beat
+
+            if self.queue_block is not None and self in self.queue_block:
+
+                self.queue_block[self].called = True
+
+            self.event_n, self.event_index = earliest
+
+            self.metro.voices.cancel(self, self.event_n)
+
+            self.metro.schedule(self, self.event_index)
+
+        return
+
     def often(self, *args, **kwargs):
         """ Calls a method every 1/2 to 4 beats using `every` """
         return self.every(PRand(1, 8)/2, *args, **kwargs)
@@ -1204,9 +1477,9 @@ class Player(Repeatable):
     def update_player_key(self, key, value, time):
         """  Forces object's dict uses PlayerKey instances
         """
-        if (key not in self.__dict__) or (not isinstance(self.__dict__[key], PlayerKey)):
+        if key not in self.player_keys:
 
-            self.__dict__[key] = PlayerKey(value, player=self, attr=key) 
+            self.player_keys[key] = PlayerKey(value, player=self, attr=key) 
 
         else:
 
@@ -1214,11 +1487,11 @@ class Player(Repeatable):
 
             if self.isplaying is False:
 
-                self.__dict__[key].set(value, time)
+                self.player_keys[key].set(value, time)
 
             else:
 
-                self.__dict__[key].update(value, time)
+                self.player_keys[key].update(value, time)
 
         return
 
@@ -1290,24 +1563,67 @@ class Player(Repeatable):
 
         if delay == 0:
 
+            # Updates from earlier events that are due now come first
+
+            if len(self.key_timeline) > 0 and self.key_timeline[0][0] <= timestamp:
+
+                self.apply_key_timeline()
+
             for key in (x for x in self.accessed_keys if x not in ignore):
 
                 self.update_player_key(key, kwargs.get(key, event.get(key, 0)), timestamp)
 
         else:
 
-            func_args = (event, timestamp + delay, 0, ignore)
+            # Add to the player's own timeline instead of the clock's queue
+
+            self.key_timeline_n += 1
+
+            heapq.heappush(self.key_timeline, (timestamp + delay, self.key_timeline_n, event, ignore, kwargs))
+
+        return
+
+    def apply_key_timeline(self):
+        """ Updates the player keys with the values from delayed events that are now due. This is
+            called when one of the player's keys is used, so updates are only made when needed """
+
+        # Previews see the beat of the event being previewed, which may be ahead of the clock,
+        # and use the current values of the keys instead
+
+        if self.metro.is_previewing():
+
+            return
+
+        timeline = self.key_timeline
+
+        now = self.metro.now()
+
+        while len(timeline) > 0 and timeline[0][0] <= now:
 
-            self.metro.schedule(self.update_player_key_from_event, timestamp + delay, args=func_args, kwargs=kwargs)
+            try:
+
+                time, n, event, ignore, kwargs = heapq.heappop(timeline)
+
+            except IndexError:
+
+                break # emptied by another thread
+
+            self.update_player_key_from_event(event, time, 0, ignore, **kwargs)
 
         return
 
     def update_player_key_relation(self, item):
         """ Called during 'now' to update any Players that a player key is related to before using that value """
 
+        # When previewing events, use the current values without updating any players
+
+        if self.metro.is_previewing():
+
+            pass
+
         # If this *is* the parent, just get the current value
 
-        if item.parent is self:
+        elif item.parent is self:
 
             self.update_player_key(item.attr, self.now(item.attr), 0)
 
@@ -1404,8 +1720,9 @@ class Player(Repeatable):
 
         return attr_value
 
-    def get_prime_funcs(self, event):
-        """ Finds and PGroupPrimes in event and returns the modulated event dictionary """
+    def get_prime_funcs(self, event, keys=None):
+        """ Finds and PGroupPrimes in event and returns the modulated event dictionary.
+            Only the keys in `keys` are checked if it is given """
 
         prime_keys = ("degree", "sample")
 
@@ -1417,7 +1734,7 @@ class Player(Repeatable):
 
         # Then do the rest (skipping prime)
 
-        for key in event:
+        for key in (event if keys is None else keys):
 
             if key not in prime_keys:
 
@@ -1486,14 +1803,78 @@ class Player(Repeatable):
 
         return event
 
-    def get_event(self):
-        """ Returns a dictionary of attr -> now values """
+    def compile_event_table(self):
+        """ Splits the player's attributes into those that have the same value for every
+            event, which are stored in a template event, and those that are calculated for
+            each event such as patterns, TimeVars, generators, and PlayerKeys. Called when
+            the attributes have changed since the table was last compiled, or when one of
+            the player's own single value patterns has been changed in place """
+
+        template = {}
+        dynamic  = []
+        versions = []
+
+        defaults = self.attr.defaults
+
+        for attr, pattern in self.attr.items():
+
+            if type(pattern) is Pattern and len(pattern) == 0:
+
+                template[attr] = 0
+
+            elif type(pattern) is Pattern and len(pattern.data) == 1 and (pattern.data[0] is None or type(pattern.data[0]) in (int, float, str)):
+
+                template[attr] = pattern.data[0]
+
+            else:
+
+                template[attr] = None
+
+                dynamic.append(attr)
+
+                continue
+
+            # The player's own patterns may be held and changed in place by the user
+
+            if pattern is not defaults.get(attr):
+
+                versions.append((pattern, pattern.version))
+
+        # Constant values can't have PGroup behaviours so only check those that can change
+
+        changes = set(dynamic) | set(("dur", "sus", "delay", "blur"))
+
+        prime_keys = [attr for attr in template if attr in changes]
+
+        self.event_table = (self.attr.version, template, dynamic, prime_keys, versions)
+
+        return self.event_table
+
+    def build_event(self, x=0):
+        """ Returns a dictionary of attr -> values for the event `x` events after the current one """
+
+        table = self.event_table
+
+        if table is None or table[0] != self.attr.version or any(pattern.version != version for pattern, version in table[4]):
+
+            table = self.compile_event_table()
+
+        version, template, dynamic, prime_keys, versions = table
 
-        self.event = dict(map(lambda attr: (attr, self.now(attr)), self.attr.keys()))
+        event = template.copy()
 
-        self.event = self.unduplicate_durs(self.event)
+        for attr in dynamic:
 
-        self.event = self.get_prime_funcs(self.event)
+            event[attr] = self.now(attr, x)
+
+        event = self.unduplicate_durs(event)
+
+        return self.get_prime_funcs(event, prime_keys)
+
+    def get_event(self):
+        """ Returns a dictionary of attr -> now values """
+
+        self.event = self.build_event()
 
         # Update internal player keys / schedule future updates
 
@@ -1502,83 +1883,244 @@ class Player(Repeatable):
         return self
 
 
+    def events(self, n=1):
+        """ Returns a list of the notes in the player's next `n` events without playing them,
+            see `iter_events` """
+        notes, events = [], self.iter_events()
+        try:
+            for event_n, beat, event_notes in itertools.islice(events, n):
+                notes.extend(event_notes)
+        finally:
+            events.close()
+        return notes
+
+    def render(self, beats):
+        """ Returns a list of the notes in the events the player will play in the next
+            `beats` beats without playing them, see `iter_events` """
+        end = self.metro.now() + beats
+        notes, events = [], self.iter_events()
+        try:
+            for event_n, beat, event_notes in events:
+                if beat >= end:
+                    break
+                notes.extend(event_notes)
+        finally:
+            events.close()
+        return notes
+
+    def iter_events(self):
+        """ Yields the event number, beat, and a list of notes for each event the player will
+            play, starting from its current state, without sending them or updating the player
+            or its keys. Each note is a dictionary of the player's attributes with any PGroups
+            unpacked, and the event number, beat, and frequency and midinote if the SynthDef
+            uses them. Rests, and notes that wouldn't be sent because their amp is 0, have no
+            notes. TimeVars are calculated at the beat of each event, values that depend on
+            other players' keys use their current values, and methods scheduled using `every`
+            are not applied """
+
+        self.metro.start_preview()
+
+        try:
+
+            for event in self.preview_events():
+
+                yield event
+
+        finally:
+
+            self.metro.stop_preview()
+
+        return
+
+    def preview_events(self):
+        """ Yields the events for `iter_events` while the clock is previewing """
+
+        n, beat = self.event_n, self.event_index
+
+        if not self.isplaying:
+
+            n, beat = self.count(self.metro.next_bar(), event_after=True)
+
+        elif self.rhythm() != self.old_dur:
+
+            # The player will count where it is again when it is next called
+
+            current_dur, self.current_dur = self.current_dur, self.rhythm()
+
+            try:
+
+                n, beat = self.count(beat)
+
+            finally:
+
+                self.current_dur = current_dur
+
+        while not (self.stopping and beat >= self.stop_point):
+
+            self.metro.set_preview_beat(beat)
+
+            try:
+
+                event = self.build_event(n - self.event_n)
+
+            finally:
+
+                self.metro.set_preview_beat(None)
+
+            dur = event["dur"]
+
+            yield n, beat, ([] if isinstance(dur, rest) else self.get_event_notes(event, n, beat))
+
+            if event["bpm"] is not None:
+
+                try:
+
+                    dur *= float(self.metro.bpm) / float(event["bpm"])
+
+                except (AttributeError, TypeError, ZeroDivisionError):
+
+                    pass
+
+            beat = beat + dur
+
+            n += 1
+
+        return
+
+    def get_event_notes(self, event, n, beat):
+        """ Returns a list of the notes that would be sent for an event, see `iter_events` """
+
+        groups = [key for key, value in event.items() if isinstance(value, PGroup)]
+
+        packets = self.expand_event(event, groups) if len(groups) > 0 else [event.copy()]
+
+        notes = []
+
+        for packet in packets:
+
+            if "amplify" in packet:
+
+                packet["amp"] = packet["amp"] * packet["amplify"]
+
+            if packet["amp"] <= 0:
+
+                continue
+
+            if self.synthdef not in (SamplePlayer, LoopPlayer):
+
+                packet["freq"], packet["midinote"] = get_freq_and_midi(packet["degree"], packet["oct"], packet["root"], self.scale)
+
+            packet["event"] = n
+            packet["beat"]  = beat
+
+            notes.append(packet)
+
+        return notes
+
     def send(self, timestamp=None, verbose=True, **kwargs):
         """ Goes through the  current event and compiles osc messages and sends to server via the tempo clock """
 
         timestamp = timestamp if timestamp is not None else self.queue_block.time
 
-        # self.do_bang = False
+        event = self.event
 
-        for i in range(self.get_event_length(**kwargs)):
+        if kwargs:
 
-            self.send_osc_message(self.event, i, timestamp=timestamp, verbose=verbose, **kwargs)
+            event = event.copy()
+            event.update(kwargs)
 
-        # if self.do_bang:
+        groups = [key for key, value in event.items() if isinstance(value, PGroup)]
 
-        #     self.bang()
+        if len(groups) == 0:
 
-        return
+            self.push_osc_to_server(event.copy(), timestamp, verbose, **kwargs)
 
-    def send_osc_message(self, event, index, timestamp=None, verbose=True, **kwargs):
-        """ Compiles and sends an individual OSC message created by recursively unpacking nested PGroups """
+        else:
 
-        packet = {}
+            for packet in self.expand_event(event, groups):
 
-        event=event.copy()
-        event.update(kwargs)
+                self.push_osc_to_server(packet, timestamp, verbose)
 
-        for key, value in event.items():
+        return
 
-            # If we can index a value, trigger a new OSC message to send OSC messages for each
+    def expand_event(self, event, groups):
+        """ Yields a packet for each message in an event whose `groups` attributes are PGroups.
+            All the PGroups are indexed together, and any nested PGroups in the result are
+            then indexed in the same way, until none are left. Each level of nesting keeps
+            a list of the values of the `groups` attributes and the next index to use, which
+            are re-used for each item in the level above """
 
-            # value = kwargs.get(key, value)
+        depth = 0
 
-            if isinstance(value, PGroup):
+        values = [[event[key] for key in groups]]
+        index  = [0]
+        size   = [self.get_group_length(values[0])]
 
-                new_event = {}
+        while depth >= 0:
 
-                for new_key, new_value in event.items():
+            i = index[depth]
 
-                    # new_value = kwargs.get(new_key, new_value)
+            if i == size[depth]:
 
-                    if isinstance(new_value, PGroup):
+                depth -= 1
 
-                        new_event[new_key]  = new_value[index]
+                continue
 
-                    else:
+            index[depth] = i + 1
 
-                        new_event[new_key] = new_value
+            items = [value[i] if isinstance(value, PGroup) else value for value in values[depth]]
 
-                # Recursively unpack and send messages
+            length = self.get_group_length(items)
 
-                for i in range(self.get_event_length(new_event)):
+            if length > 0:
 
-                    self.send_osc_message(new_event, i, timestamp, verbose)
+                # Nested PGroups: index the new values in the next level
 
-                return
+                depth += 1
 
-            else:
+                if depth == len(values):
 
-                # If it is a number, use the numbers (check for kwargs override)
-                
-                packet[key] = value
+                    values.append(items)
+                    index.append(0)
+                    size.append(length)
 
-        # Special case modulations
+                else:
 
-        if ("amp" in packet) and ("amplify" in packet):
+                    values[depth] = items
+                    index[depth]  = 0
+                    size[depth]   = length
 
-            packet["amp"] = packet["amp"] * packet["amplify"]
+                continue
+
+            packet = event.copy()
 
-        # Send compiled messages
+            for key, value in zip(groups, items):
 
-        self.push_osc_to_server(packet, timestamp, verbose, **kwargs)
+                packet[key] = value
+
+            yield packet
 
         return
 
+    @staticmethod
+    def get_group_length(values):
+        """ Returns the length of the largest PGroup in a list of values, or 0 if there are none """
+        length = 0
+        for value in values:
+            if isinstance(value, PGroup) and len(value) > length:
+                length = len(value)
+        return length
+
     def push_osc_to_server(self, packet, timestamp, verbose=True, **kwargs):
         """ Adds message head, calculating frequency then sends to server if verbose is True and 
             amp/bufnum values meet criteria """
 
+        # Special case modulations
+
+        if ("amp" in packet) and ("amplify" in packet):
+
+            packet["amp"] = packet["amp"] * packet["amplify"]
+
         # Do any calculations e.g. frequency
 
         message = self.new_message_header(packet, **kwargs)
@@ -1593,7 +2135,32 @@ class Player(Repeatable):
 
             synthdef = self.get_synth_name(message.get("buf", 0)) # to send to play1 or play2
 
-            compiled_msg = self.metro.server.get_bundle(synthdef, message, timestamp = timestamp + delay)
+            # Count the note if the number playing at once is limited
+
+            voices = self.metro.voices
+
+            if synthdef != "MidiOut" and voices.limited(self):
+
+                group_id = self.metro.server.nextnodeID()
+
+                stolen = voices.add(self, self.event_n, timestamp + delay, message["sus"], group_id)
+
+                if stolen is None:
+
+                    return
+
+                for node, free_time in stolen:
+
+                    free_msg = OSCBundle(time=free_time)
+                    free_msg.append(OSCMessage("/n_free", [node]))
+
+                    self.queue_block.append_osc_message(free_msg)
+
+                compiled_msg = self.metro.server.get_bundle(synthdef, message, timestamp = timestamp + delay, group_id = group_id)
+
+            else:
+
+                compiled_msg = self.metro.server.get_bundle(synthdef, message, timestamp = timestamp + delay)
 
             # We can set a condition to only send messages
 
@@ -1746,6 +2313,12 @@ class Player(Repeatable):
         
         self.reset()
 
+        # Don't play any events that were built ahead of time
+
+        if self.metro.lookahead > 0:
+
+            self.metro.sender.cancel(self)
+
         if self in self.metro.playing:
         
             self.metro.playing.remove(self)
@@ -2002,7 +2575,9 @@ class Group:
 
     def __init__(self, *args):
 
-        self.players = list(args)
+        # Set directly as `__setattr__` sets the attribute of each player
+
+        self.__dict__["players"] = list(args)
 
     def add(self, other):
         self.players.append(other)
@@ -6,6 +6,7 @@ from .Utils import modi
 from .TimeVar import var, Pvar
 
 import inspect
+import bisect
 
 class MethodList:
     """ Class for holding information about the order of which methods have been
@@ -85,7 +86,15 @@ class Repeatable(object):
 
             self.previous_patterns[attr] = MethodList(self.attr[attr])
 
-        result = self.previous_patterns[attr].get_root_pattern()
+        methods = self.previous_patterns[attr]
+
+        # Default patterns are shared by players so copy one before any in-place methods change it
+
+        if len(methods.list_of_methods) > 0 and methods.get_root_pattern() is self.attr.defaults.get(attr):
+
+            methods.set_root_pattern(methods.get_root_pattern().copy())
+
+        result = methods.get_root_pattern()
 
         # For each method in the list, call on the pattern
 
@@ -224,7 +233,7 @@ class Repeatable(object):
 
                 time = self.metro.next_bar() + n
 
-            self.metro.schedule( event, time )
+            self.metro.schedule_timer( event, time )
 
         except:
 
@@ -410,6 +419,19 @@ class MethodCall:
         self.args = args
         self.kwargs = kwargs
 
+        # Store the running total of durations for `count`
+
+        self.durations = [float(dur) for dur in self.when]
+        self.total_durations = []
+
+        total = 0
+
+        for dur in self.durations:
+
+            total += dur
+
+            self.total_durations.append(total)
+
         # Check if a method has the _beat_ keyword argument
 
         if "_beat_" in inspect.getargspec(self.method).args:
@@ -425,41 +447,33 @@ class MethodCall:
     def count(self):
         """ Counts the number of times this method would have been called between clock start and now """
 
-        n = 0; acc = 0; dur = 0
         now = float(self.parent.metro.now())
 
-        # Get durations
+        durations = self.durations
 
-        durations = self.when # if self.cycle is None else asStream(self.cycle)
-        total_dur = float(sum(durations))
+        total_dur = self.total_durations[-1] if len(durations) else 0
 
-        # How much time left to fit remainder in
+        # Number of whole cycles through the durations
 
         try:
-       
-            acc = now - (now % total_dur)
+
+            cycles = now // total_dur
 
         except ZeroDivisionError:
 
-            acc = 0
+            return 0, 0
 
-        # n is the index to return for calculating self.when[n]
-        # acc is when to start
+        n   = int(len(durations) * cycles)
+        acc = total_dur * cycles
 
-        n = int(len(durations) * (acc / total_dur))
+        # Find the first event at or after now in the current cycle
 
         if acc != now:
 
-            while True:
-
-                dur = float(durations[n])
+            i = min(bisect.bisect_left(self.total_durations, now - acc), len(durations) - 1)
 
-                acc += dur
-                n   += 1
-
-                if acc >= now:
-
-                    break
+            n   += i + 1
+            acc += self.total_durations[i]
 
         return n, acc
 
@@ -475,6 +489,8 @@ class MethodCall:
         
         if self.stopping:
 
+            self.parent.metro.timer_done(self)
+
             return
 
         # Give the method a reference to when OSC messages should send
@@ -526,7 +542,7 @@ class MethodCall:
 
     def schedule(self):
         """ Schedules the method to be called in the clock """
-        self.parent.metro.schedule(self, self.get_next())
+        self.parent.metro.schedule_timer(self, self.get_next())
 
     def isScheduled(self):
         """ Returns True if this is in the Tempo Clock """
@@ -14,6 +14,8 @@ import sys
 import threading
 import time
 import itertools
+import struct
+import math
 import os.path
 
 from collections import namedtuple
@@ -203,6 +205,7 @@ class SCLangServerManager(ServerManager):
         self.bus = self.num_input_busses + self.num_output_busses
         self.max_busses = 100
         self.max_buffers = 1024
+        self.max_nodes = 1024
 
         self.fx_setup_done = False
         self.fx_names = {}
@@ -222,6 +225,7 @@ class SCLangServerManager(ServerManager):
                 self.num_input_busses = info.num_input_bus_channels
                 self.num_output_busses = info.num_output_bus_channels
                 self.max_busses = info.num_audio_bus_channels
+                self.max_nodes = info.max_nodes
                 self.bus = self.num_input_busses + self.num_output_busses
         else:
             self.sclang = OSCClientWrapper()
@@ -499,8 +503,9 @@ class SCLangServerManager(ServerManager):
 
         return msg, node
 
-    def get_bundle(self, synthdef, packet, timestamp=0):
-        """ Returns the OSC Bundle for a notew based on a Player's SynthDef, and event and effects dictionaries """ 
+    def get_bundle(self, synthdef, packet, timestamp=0, group_id=None):
+        """ Returns the OSC Bundle for a notew based on a Player's SynthDef, and event and effects dictionaries.
+            The note is played in a new group, which uses `group_id` as its node ID if given """ 
 
         # Create a specific message for midi
 
@@ -517,7 +522,8 @@ class SCLangServerManager(ServerManager):
         synthdef = self.synthdefs[synthdef]
 
         # Create a group for the note
-        group_id = self.nextnodeID()
+        if group_id is None:
+            group_id = self.nextnodeID()
         msg = OSCMessage("/g_new")
         msg.append( [group_id, 1, 1] )
         
@@ -749,6 +755,61 @@ class SCLangServerManager(ServerManager):
             self.stopRecording()
         return
 
+class NRTScore(object):
+    """ Stores the OSC bundles sent by the clock when rendering in non-realtime so
+        that they can be written as a SuperCollider score file for `scsynth -N`.
+        Times are in seconds from `start_time`. Each entry in the file is a bundle
+        with a score-relative timetag, prefixed by its length as a 32 bit int. """
+    def __init__(self, start_time=0):
+        self.start_time = start_time
+        self.bundles = [] # (time, message binary)
+
+    def __len__(self):
+        return len(self.bundles)
+
+    def sendOSC(self, osc_message):
+        """ Adds a bundle or message in place of sending it to the server. Messages
+            for MIDI devices cannot be rendered by scsynth and are ignored """
+        if osc_message.address == OSC_MIDI_ADDRESS:
+            return
+        if isinstance(osc_message, OSCBundle):
+            self.bundles.append((max(0.0, osc_message.timetag - self.start_time), osc_message.message))
+        else:
+            self.bundles.append((0.0, OSCBlob(osc_message.getBinary())))
+        return
+
+    def add_message(self, time, address, args=()):
+        """ Adds a single OSC message at `time` seconds into the score """
+        message = OSCMessage(address)
+        message.append(list(args))
+        self.bundles.append((float(time), OSCBlob(message.getBinary())))
+        return
+
+    def end_time(self):
+        return max([t for t, msg in self.bundles]) if self.bundles else 0.0
+
+    def getBinary(self, duration=None):
+        """ Returns the score as binary data, sorted by time. A dummy message is added
+            at `duration` seconds, or a second after the last bundle, so that scsynth
+            renders the tail of the last events """
+        if duration is None:
+            duration = self.end_time() + 1
+        end = OSCMessage("/c_set")
+        end.append([0, 0])
+        bundles = sorted(self.bundles, key=lambda x: x[0]) + [(float(duration), OSCBlob(end.getBinary()))]
+        data = []
+        for t, msg in bundles:
+            fract, secs = math.modf(t)
+            bundle = OSCString("#bundle") + struct.pack('>LL', int(secs), int(fract * NTP_units_per_second)) + msg
+            data.append(struct.pack('>i', len(bundle)) + bundle)
+        return b"".join(data)
+
+    def write(self, filename, duration=None):
+        """ Writes the score to file """
+        with open(filename, "wb") as f:
+            f.write(self.getBinary(duration))
+        return
+
 try:
     
     import socketserver
@@ -891,7 +952,7 @@ class RequestHandler(socketserver.BaseRequestHandler):
 
         assert "init" in data
 
-        send_to_socket(self.request, {"clock_time": time.time()}) # maybe time at a beat?
+        send_to_socket(self.request, {"clock_time": self.metro.get_machine_time()}) # maybe time at a beat?
 
         self.master.peers.append(self)
 
@@ -1001,11 +1062,11 @@ class TempoClient:
 
     def start_timing(self):
         """ Starts an internal timer for calculating latency """
-        self.start_time = time.time()
+        self.start_time = self.metro.get_machine_time()
 
     def stop_timing(self):
         """ Stops the internal timer and calculates latency  """
-        self.stop_time = time.time()
+        self.stop_time = self.metro.get_machine_time()
         self.calculate_latency(self.start_time, self.stop_time)
 
     def calculate_latency(self, start, end):
@@ -11,8 +11,9 @@
     be activated. A queue block has a "beat" value for which its contents should be activated. To make
     sure that events happen on time, the `TempoClock` will begin processing the contents 0.25
     seconds before it is *actually* meant to happen in case there is a large amount to process.  When 
-    a queue block is activated, a new thread is created to process all of the callable objects it
-    contains. If it calls a `Player` object, the queue block keeps track of the OSC messages generated 
+    a queue block is activated, it is handed to one of the clock's worker threads which processes all
+    of the callable objects it contains. The number of worker threads can be changed using 
+    `Clock.set_workers(n)`. If it calls a `Player` object, the queue block keeps track of the OSC messages generated 
     until all `Player` objects in the block have been called. At this point the thread is told to
     sleep until the remainder of the 0.25 seconds has passed. This value is stored in `Clock.latency`
     and is adjustable. If you find that there is a noticeable jitter between events, i.e. irregular
@@ -20,12 +21,52 @@
 
         Clock.latency = 0.5
 
+    Between blocks the clock thread sleeps until the next one is due, waking early if an earlier
+    block is scheduled or the tempo changes. The previous behaviour of checking the queue every
+    `Clock.sleep_time` seconds can be used with `Clock.set_polling(True)` and the two can be
+    compared using `Clock.clock_stats()`. `Clock.stats()` shows how late blocks are being called and
+    how long they take, which can be reset using `Clock.reset_stats()`.
+    To find out which players or methods are slow, use `Clock.profile()` and then `print(Clock.profiler)`.
+    If Python stalls and blocks are activated late, `Clock.set_late_policy` chooses whether they are
+    sent anyway, called without sending, caught up in a single pass, or sent with compressed timestamps.
+    `Clock.set_max_blocks(n, action)` limits how many blocks can be waiting for the worker threads.
+    `Clock.set_voice_limit(total, player)` limits how many notes can play at once, stealing the oldest
+    notes or dropping new ones, and `Clock.voices.active()` returns how many are playing.
+    `Clock.set_bundle_size(size)` sends the notes due at the same time in as few UDP datagrams of up
+    to `size` bytes as possible, instead of one datagram per note.
+
+    Using `Clock.set_lookahead(seconds)`, queue blocks are called up to that many seconds before
+    they are due and the OSC bundles they create are held until `Clock.latency` seconds before
+    they should play. This means Python's processing time no longer has to fit inside the latency
+    so a much lower value, e.g. `Clock.latency = 0.05`, can be used. Events a player has built
+    but not sent are built again if the player is updated.
+
+    The clock's queue can also be rendered in non-realtime using `Clock.render_nrt(filename, beats)`,
+    which calls the queue blocks as fast as possible using a virtual clock and writes the OSC bundles
+    to a SuperCollider score file that can be rendered to audio with `scsynth -N`.
+
+    The clock reads the time from a time source, which can be changed using `Clock.set_time_source`.
+    `WallTime` is used by default and `MonotonicTime` ignores changes to the system clock. With a
+    `ManualTime` source the clock thread does not run and `Clock.step(beats)` calls the blocks due
+    in that time straight away, which is useful for testing and benchmarking.
+
+    The OSC messages sent for the last 64 beats are kept in `Clock.history` so that moving the clock
+    back using `Clock.set_time` or `Clock.shift` sends them again instead of re-calculating them. The
+    history can be saved for inspection using `Clock.history.export(filename)`.
+
+    To run FoxDot inside an asyncio application, `AsyncTempoClock` in `AsyncTempoClock.py` calls
+    the queue blocks from a coroutine on an event loop instead of the clock and worker threads.
+
     To stop the clock from scheduling further events, use the `Clock.clear()` method, which is
     bound to the shortcut key, `Ctrl+.`. You can schedule non-player objects in the clock by
     using `Clock.schedule(func, beat, args, kwargs)`. By default `beat` is set to the next
     bar in the clock, but you use `Clock.now() + n` or `Clock.next_bar() + n` to schedule a function
     in the future at a specific time. 
 
+    Methods called repeatedly using `every`, `after`, and `Clock.every` are scheduled using
+    `Clock.schedule_timer` in a `TimerWheel`, which costs less than adding to the queue, and are
+    called in the same queue block as anything else due at that beat.
+
     To change the tempo of the clock, just set the bpm attribute using `Clock.bpm=val`. The change
     in tempo will occur at the start of the next bar so be careful if you schedule this action within
     a function like this:
@@ -53,20 +94,35 @@ from types import FunctionType, MethodType
 from .Players import Player
 from .Repeat import MethodCall
 from .Patterns import asStream
-from .TimeVar import TimeVar
+from .TimeVar import TimeVar, linvar
 from .Midi import MidiIn, MIDIDeviceNotFound
-from .Utils import modi
-from .ServerManager import TempoClient, ServerManager, RequestTimeout
-from .Settings import CPU_USAGE, CLOCK_LATENCY
+from .Utils import modi, LCM
+from .Constants import inf
+from .ServerManager import TempoClient, ServerManager, RequestTimeout, NRTScore, OSCBundle
+from .Settings import CPU_USAGE, CLOCK_LATENCY, OSC_MIDI_ADDRESS
+from .Code import WarningMsg
 
 import time
+import json
+import binascii
 from fractions import Fraction
+from collections import OrderedDict, deque
 from traceback import format_exc as error_stack
 
 import sys
+import heapq
+import bisect
+import math
 import threading
 import inspect
 
+if sys.version_info[0] > 2:
+    import queue
+    getargspec = inspect.getfullargspec
+else:
+    import Queue as queue
+    getargspec = inspect.getargspec
+
 class TempoClock(object):
 
     tempo_server = None
@@ -95,7 +151,7 @@ class TempoClock(object):
         # Player Objects stored here
         self.playing = []
 
-        # Store history of osc messages and functions in here
+        # Store history of osc messages in here, see `History`
         self.history = History()
 
         # All other scheduled items go here
@@ -107,6 +163,9 @@ class TempoClock(object):
 
         # Create the queue
         self.queue = Queue(self)
+
+        # Repeated method calls are scheduled in a timer wheel instead of the queue
+        self.wheel = TimerWheel()
         self.current_block = None
         
         # Midi Clock In
@@ -124,14 +183,63 @@ class TempoClock(object):
         self.nudge      = 0.0  # If you want to synchronise with something external, adjust the nudge
         self.hard_nudge = 0.0
 
-        self.bpm_start_time = time.time()
+        # Source of machine time, see `set_time_source`
+        self.time_source = WallTime()
+
+        self.bpm_start_time = self.time_source.time()
         self.bpm_start_beat = 0
 
+        # TempoMap for a TimeVar bpm, see `get_tempo_map`
+        self.tempo_map = None
+
         # The duration to sleep while continually looping
         self.sleep_values = [0.01, 0.001, 0.0001]
         self.sleep_time = self.sleep_values[CPU_USAGE]
         self.midi_nudge = 0
 
+        # Unless polling, the clock sleeps until the next block is due and then spins
+        # for the last `spin_time` seconds. It is woken early if an earlier block is
+        # scheduled or the tempo changes.
+        self.polling = False
+        self.wake = threading.Condition()
+        self.spin_time = 0.001
+        self.max_sleep_time = 0.1
+        self.loop_stats = LoopStats()
+        self.block_stats = BlockStats()
+
+        # What to do with blocks activated more than `late_threshold` seconds late, see `set_late_policy`
+        self.late_policy = "send"
+        self.late_threshold = 0.1
+        self.compress_ratio = 0.25
+        self.catch_up = None
+
+        # True while a late block is calling the overdue blocks for the "coalesce" late policy
+        self.catching_up = False
+
+        # Limit on blocks waiting for or being called by the workers, see `set_max_blocks`
+        self.max_blocks = None
+        self.overload_action = "warn"
+        self.overloaded = False
+
+        # Packs note bundles into datagrams when set to a `BundlePacker`, see `set_bundle_size`
+        self.packer = None
+
+        # Counts the notes playing on the server and limits them, see `set_voice_limit`
+        self.voices = VoiceManager(self)
+
+        # Times each item called in a queue block when set to a `Profiler`, see `Clock.profile`
+        self.profiler = None
+
+        # In lookahead mode, blocks are called up to `lookahead` seconds before they are due
+        # and the OSC bundles they create are held by `sender` until `latency` seconds
+        # before their timetag. `render` stores the beat of the block being called.
+        self.lookahead = 0
+        self.sender = BundleSender(self)
+        self.render = threading.local()
+
+        # When rendering in non-realtime, OSC bundles are added to `score` instead of being sent
+        self.score = None
+
         # Debug
         self.debugging = False
         self.__setup   = True
@@ -139,6 +247,9 @@ class TempoClock(object):
         # If one object is going to played
         self.solo = SoloPlayer()
 
+        # Worker threads that call the queue blocks
+        self.executor = BlockExecutor(self.__run_block, timer=self.get_machine_time)
+
         self.thread = threading.Thread(target=self.run)
 
     def sync_to_espgrid(self, host="localhost", port=5510):
@@ -181,7 +292,7 @@ class TempoClock(object):
         """ Deprecated """
         self.time = self.dtype(0)
         self.beat = self.dtype(0)
-        self.start_time = time.time()
+        self.start_time = self.get_machine_time()
         print("resetting clock")
         return
 
@@ -240,11 +351,11 @@ class TempoClock(object):
         return len(self.queue)
 
     def __contains__(self, item):
-        return item in self.items
+        return item in self.items or item in self.wheel
 
     def update_tempo_now(self, bpm):
         """ emergency override for updating tempo"""
-        self.last_now_call = self.bpm_start_time = time.time()
+        self.last_now_call = self.bpm_start_time = self.get_machine_time()
         self.bpm_start_beat = self.now()
         object.__setattr__(self, "bpm", self._convert_json_bpm(bpm))
         # self.update_network_tempo(bpm, start_beat, start_time) -- updates at the bar...
@@ -324,6 +435,283 @@ class TempoClock(object):
         self.sleep_time = self.sleep_values[value]
         return
 
+    def set_lookahead(self, seconds=0.2):
+        """ Sets how many seconds ahead of time queue blocks are called. The OSC bundles
+            they create are held in memory and sent `latency` seconds before they are
+            due, so a much lower latency can be used. Events that have been built but not
+            sent are re-built if a player is updated. Set to 0 to turn off. """
+        self.lookahead = max(0.0, float(seconds))
+        if self.lookahead > 0:
+            self.sender.start()
+        self.notify()
+        return
+
+    def get_lookahead(self):
+        """ Returns the number of beats ahead of time blocks are called """
+        return self.seconds_to_beats(self.lookahead) if self.lookahead > 0 else 0
+
+    def is_rendering(self):
+        """ Returns True if called by a queue block being called in lookahead mode """
+        return getattr(self.render, "beat", None) is not None
+
+    def start_preview(self):
+        """ Starts previewing events in the calling thread, which lets a player's events be
+            calculated ahead of time without being scheduled, see `Player.iter_events` """
+        self.render.preview = None
+        self.render.preview_copies = {}
+        return
+
+    def set_preview_beat(self, beat):
+        """ Makes `now` return `beat` in the calling thread while previewing events. Use
+            `None` to go back to the clock's time """
+        self.render.preview = beat
+        return
+
+    def is_previewing(self):
+        """ Returns True if called while previewing an event """
+        return getattr(self.render, "preview", None) is not None
+
+    def get_preview_copy(self, obj):
+        """ Returns a copy of an object that changes as time passes, such as a TimeVar, to be
+            used in its place for the rest of the preview. The object itself may be in use by
+            the clock at the same time so it is never changed by a preview """
+        copies = getattr(self.render, "preview_copies", None)
+        if copies is None:
+            return obj
+        if id(obj) not in copies:
+            new = object.__new__(obj.__class__)
+            new.__dict__.update(obj.__dict__)
+            copies[id(obj)] = (obj, new) # keep `obj` so its id isn't reused
+            copies[id(new)] = (new, new)
+        return copies[id(obj)][1]
+
+    def stop_preview(self):
+        """ Stops previewing events and discards the copies used in the preview """
+        self.render.preview = self.render.preview_copies = None
+        return
+
+    def get_render_source(self):
+        """ Returns the player, event number and beat of the event currently being
+            built in lookahead mode, or None if the object being called is not a player """
+        item = getattr(self.render, "item", None)
+        if isinstance(item, Player):
+            return (item, item.event_n, item.event_index)
+        return None
+
+    def set_workers(self, n):
+        """ Sets the number of worker threads used to call queue blocks. Blocks are
+            started in the order they are due, so a single worker calls them strictly
+            one after the other """
+        self.executor.set_workers(n)
+        return
+
+    def clock_stats(self):
+        """ Returns a dictionary with the clock thread's CPU usage and how late, in
+            seconds, it activated queue blocks """
+        data = self.loop_stats.stats()
+        data["mode"] = "polling" if self.polling else "deadline"
+        return data
+
+    def worker_stats(self):
+        """ Returns a dictionary of counters for the worker threads e.g. the number of
+            blocks waiting to be called and how long they waited """
+        return self.executor.stats()
+
+    def stats(self):
+        """ Returns a dictionary of timing information for the clock: how late queue
+            blocks were called, how long they took, how many items they held, and how many
+            OSC bundles were dropped because their timetag had passed. Lateness is in
+            seconds and counted in `BlockStats.lateness_bins`. Includes `clock_stats` and
+            `worker_stats` """
+        data = self.block_stats.stats()
+        data["clock"] = self.clock_stats()
+        data["workers"] = self.worker_stats()
+        data["sender"] = {"sent": self.sender.sent, "cancelled": self.sender.cancelled, "pending": len(self.sender)}
+        data["voices"] = self.voices.stats()
+        return data
+
+    def profile(self, on=True, bars=4):
+        """ Times how long each item in the clock, e.g. a player, every() method, or
+            function, takes to call over the last `bars` bars. Print `Clock.profiler`
+            or use `Clock.profiler.report(n)` to see the items that took longest """
+        self.profiler = Profiler(self, bars) if on else None
+        return
+
+    def reset_stats(self):
+        """ Resets the counters returned by `Clock.stats()` """
+        self.block_stats.reset()
+        self.loop_stats.reset()
+        self.executor.reset_stats()
+        self.sender.sent = self.sender.cancelled = 0
+        self.voices.reset_stats()
+        return
+
+    def set_polling(self, value=True):
+        """ If True, the clock checks the queue every `sleep_time` seconds instead of
+            sleeping until the next block is due """
+        self.polling = bool(value)
+        self.loop_stats.reset()
+        self.notify()
+        return
+
+    late_policies = ("send", "drop", "coalesce", "compress")
+
+    def set_late_policy(self, policy="send", threshold=0.1, ratio=0.25):
+        """ Sets what the clock does with queue blocks that are activated more than
+            `threshold` seconds late, e.g. after Python has stalled:
+
+            - "send": call them as normal. Bundles whose timetag has passed are dropped
+            - "drop": call them without sending any OSC messages so that players keep time
+            - "coalesce": call every overdue block in one catch-up pass, without sending any
+               OSC messages, before going back to the blocks that are on time
+            - "compress": send them all, starting `latency` seconds from now with the time
+               between them multiplied by `ratio`
+
+            What was done is counted in `Clock.stats()["late_blocks"]` """
+        assert policy in self.late_policies, "Late policy must be one of {}".format(self.late_policies)
+        self.late_policy = policy
+        self.late_threshold = float(threshold)
+        self.compress_ratio = float(ratio)
+        self.catch_up = None
+        return
+
+    def handle_late_block(self, block, beat, force=False):
+        """ Applies the late policy to a block that is about to be activated on `beat`.
+            Returns True if the block should be called. If `force` is True the block is
+            treated as late however late it is """
+
+        if self.late_policy == "send":
+
+            return True
+
+        lateness = self.get_time() + self.lookahead - self.get_time_at_beat(block.beat)
+
+        if lateness <= self.late_threshold and not force:
+
+            self.catch_up = None
+
+            return True
+
+        if self.late_policy == "drop":
+
+            block.silent = True
+
+            self.block_stats.add_late("dropped")
+
+        elif self.late_policy == "coalesce":
+
+            # When the block is called it calls all the overdue blocks, including any the players
+            # schedule while doing so. The clock waits for it to finish before activating any
+            # more blocks so that they are still called in order
+
+            block.silent = True
+
+            block.catch_up = beat + self.get_lookahead() - self.seconds_to_beats(self.late_threshold)
+
+            self.catching_up = True
+
+        elif self.late_policy == "compress":
+
+            # Space the late blocks out from the first one using `compress_ratio`
+
+            if self.catch_up is None:
+
+                self.catch_up = (block.beat, self.get_machine_time() + self.latency)
+
+            start_beat, start_time = self.catch_up
+
+            block.late_time = max(start_time + self.beat_dur(block.beat - start_beat) * self.compress_ratio, self.get_machine_time() + self.latency)
+
+            self.block_stats.add_late("compressed")
+
+        return True
+
+    overload_actions = ("warn", "thin", "late")
+
+    def set_max_blocks(self, n=None, action="warn"):
+        """ Limits the number of queue blocks that can be waiting for, or being called by,
+            the worker threads. When the limit is reached the clock is overloaded and each
+            new block is dealt with using `action`:
+
+            - "warn": print a warning when the clock becomes overloaded
+            - "thin": call the block without sending any OSC messages
+            - "late": use the late policy, see `set_late_policy`, as if the block were late
+
+            Use `None` to remove the limit. The number of overloaded blocks is counted in
+            `Clock.stats()["late_blocks"]` """
+        assert n is None or n > 0, "Maximum number of blocks must be at least 1"
+        assert action in self.overload_actions, "Overload action must be one of {}".format(self.overload_actions)
+        self.max_blocks = n
+        self.overload_action = action
+        self.overloaded = False
+        return
+
+    def handle_overload(self, block, beat):
+        """ Applies the overload action to a block if the workers already have `max_blocks`
+            blocks to call. Returns True if the block should be called """
+
+        if self.max_blocks is None or self.executor.in_flight() < self.max_blocks:
+
+            self.overloaded = False
+
+            return True
+
+        self.block_stats.add_late("overloaded")
+
+        if self.overload_action == "warn":
+
+            if not self.overloaded:
+
+                WarningMsg("Clock is overloaded: {} blocks are waiting to be called".format(self.executor.in_flight()))
+
+        elif self.overload_action == "thin":
+
+            block.silent = True
+
+        elif self.overload_action == "late":
+
+            self.overloaded = True
+
+            return self.handle_late_block(block, beat, force=True)
+
+        self.overloaded = True
+
+        return True
+
+    def set_voice_limit(self, total=None, player=None, policy="steal"):
+        """ Limits the number of notes that can be playing on the server at once to `total`,
+            and to `player` for each player. A player's own limit can be set using its
+            `max_voices` attribute e.g. `p1.max_voices = 4`. When a new note would go over
+            a limit, `policy` is used:
+
+            - "steal": free the note that started first when the new note starts
+            - "drop": don't send the new note
+
+            Each note uses a group and at least three synth nodes, so to stay within the
+            server's `max_nodes` use a total of less than a quarter of it, or less if
+            effects are used. Use `None` to remove a limit. The number of notes playing,
+            stolen and dropped are shown in `Clock.stats()["voices"]` """
+        self.voices.set_limit(total, player, policy)
+        return
+
+    def set_bundle_size(self, size=1472):
+        """ Packs the OSC bundles for notes that are sent at the same time into datagrams of
+            up to `size` bytes. Notes with the same timetag are merged into one bundle, and
+            these are nested in a bundle that is sent as one datagram, so notes that are
+            delayed keep their own timetag. The default size fits the payload of a UDP
+            packet on a network with an MTU of 1500. A note is often 500-1000 bytes, so if
+            SuperCollider is running on the same machine a larger size such as 8192 packs
+            many more notes into each datagram. Use `None` to send each note's bundle on its
+            own. MIDI messages are always sent on their own """
+        self.packer = None if size is None else BundlePacker(size)
+        return
+
+    def notify(self):
+        """ Wakes the clock thread so that it re-calculates when the next block is due """
+        with self.wake:
+            self.wake.notify_all()
+        return
+
     def set_latency(self, value):
         """ Sets the `latency` attribute to values based on desired high/low/medium latency """
         assert 0 <= value <= 2
@@ -357,6 +745,14 @@ class TempoClock(object):
 
             self.update_network_tempo(value, start_beat, start_time)
 
+        elif attr in ("bpm_start_time", "bpm_start_beat") and self.__setup:
+
+            # The tempo has changed so the next block might be due at a different time
+
+            self.__dict__[attr] = value
+
+            self.notify()
+
         elif attr == "midi_nudge" and self.__setup:
 
             # Adjust nudge for midi devices
@@ -381,7 +777,14 @@ class TempoClock(object):
 
     def beat_dur(self, n=1):
         """ Returns the length of n beats in seconds """
-        return 0 if n == 0 else (60.0 / self.get_bpm()) * n
+        if n == 0:
+            return 0
+        if isinstance(self.bpm, TimeVar):
+            tempo_map = self.get_tempo_map()
+            if tempo_map is not None:
+                beat = self.now()
+                return tempo_map.get_seconds(beat + n) - tempo_map.get_seconds(beat)
+        return (60.0 / self.get_bpm()) * n
 
     def beats_to_seconds(self, beats):
         return self.beat_dur(beats)
@@ -393,7 +796,8 @@ class TempoClock(object):
     def get_bpm(self):
         """ Returns the current beats per minute as a floating point number """
         if isinstance(self.bpm, TimeVar):
-            bpm_val = self.bpm.now(self.beat)
+            tempo_map = self.get_tempo_map()
+            bpm_val = self.bpm.now(self.beat) if tempo_map is None else tempo_map.get_bpm(self.beat)
         elif self.midi_clock:
             bpm_val = self.midi_clock.bpm
         else:
@@ -412,14 +816,60 @@ class TempoClock(object):
         """ Returns the time since the last change in bpm """
         return self.get_time() - self.bpm_start_time
 
+    def get_machine_time(self):
+        """ Returns the current time from the clock's time source """
+        return self.time_source.time()
+
+    def set_time_source(self, source):
+        """ Sets the source of machine time used by the clock, e.g. `MonotonicTime()` or
+            `ManualTime()`. The current beat is kept the same. When using a `ManualTime`
+            source, the clock thread is stopped and `Clock.step` is used to move time on """
+
+        assert isinstance(source, TimeSource)
+
+        beat = self.now()
+
+        if source.manual:
+
+            self.ticking = False
+
+            self.notify()
+
+            if self.thread.is_alive() and self.thread is not threading.current_thread():
+
+                self.thread.join()
+
+        self.time_source = source
+
+        self.last_now_call = self.bpm_start_time = self.get_machine_time()
+
+        self.bpm_start_beat = self.beat = beat
+
+        return
+
     def get_time(self):
         """ Returns current machine clock time with nudges values added """
-        return time.time() + float(self.nudge) + float(self.hard_nudge)
+        return self.get_machine_time() + float(self.nudge) + float(self.hard_nudge)
+
+    def get_tempo_map(self):
+        """ Returns a `TempoMap` for the bpm if it is a TimeVar whose tempo can be
+            calculated exactly, or None. The map is stored until the TimeVar changes """
+        bpm = self.bpm
+        if not isinstance(bpm, TimeVar):
+            return None
+        cached = self.tempo_map
+        if cached is None or cached[0] is not bpm or cached[1] is not bpm.values or cached[2] is not bpm.dur or cached[3] != bpm.start_time:
+            cached = self.tempo_map = (bpm, bpm.values, bpm.dur, bpm.start_time, TempoMap.from_timevar(bpm))
+        return cached[4]
 
     def get_time_at_beat(self, beat):
         """ Returns the time that the local computer's clock will be at 'beat' value """
         if isinstance(self.bpm, TimeVar):
-            t = self.get_time() + self.beat_dur(beat - self.now())        
+            tempo_map = self.get_tempo_map()
+            if tempo_map is not None:
+                t = self.bpm_start_time + tempo_map.get_seconds(beat) - tempo_map.get_seconds(self.bpm_start_beat)
+            else:
+                t = self.get_time() + self.beat_dur(beat - self.now())
         else:
             t = self.bpm_start_time + self.beat_dur(beat - self.bpm_start_beat) 
         return t
@@ -443,15 +893,32 @@ class TempoClock(object):
         return
 
     def set_time(self, beat):
-        """ Set the clock time to 'beat' and update players in the clock """
-        self.start_time = time.time()
+        """ Set the clock time to 'beat' and update players in the clock. If moving back
+            to a beat that is still in the clock's history, the OSC messages that were
+            sent are replayed up to the current beat and the players continue from there """
+        now = self.now()
+        self.start_time = self.get_machine_time()
         self.queue.clear()
+        self.wheel.clear()
         self.beat = beat
         self.bpm_start_beat = beat
         self.bpm_start_time = self.start_time
         # self.time = time() - self.start_time
-        for player in self.playing:
-            player(count=True)
+        if beat < now and self.history.covers(beat):
+            for old_beat in self.history.beats(beat, now):
+                self.schedule(self._replay_history, old_beat, args=(old_beat,), is_priority=True)
+            for player in self.playing:
+                self.schedule(player, now, kwargs={"count": True})
+        else:
+            for player in self.playing:
+                player(count=True)
+        return
+
+    def _replay_history(self, beat):
+        """ Sends the OSC messages stored in the history for `beat` again """
+        server = self.server if self.score is None else self.score
+        for bundle in self.history.get_bundles(beat, self.get_time_at_beat(beat) + self.latency):
+            server.sendOSC(bundle)
         return
 
     def calculate_nudge(self, time1, time2, latency):
@@ -487,17 +954,32 @@ class TempoClock(object):
 
     def _now(self):
         """ If the bpm is an int or float, use time since the last bpm change to calculate what the current beat is. 
-            If the bpm is a TimeVar, increase the beat counter by time since last call to _now()"""
+            If the bpm is a TimeVar, use its TempoMap or, if it doesn't have one, increase the beat counter by
+            time since last call to _now()"""
         if isinstance(self.bpm, (int, float)):
             self.beat = self.bpm_start_beat + self.get_elapsed_beats_from_last_bpm_change()
         else:
+            tempo_map = self.get_tempo_map()
             now = self.get_time()
-            self.beat += (now - self.last_now_call) * (self.get_bpm() / 60)
+            if tempo_map is not None:
+                # Exact position on the tempo map since the TimeVar bpm started
+                self.beat = tempo_map.get_beat(tempo_map.get_seconds(self.bpm_start_beat) + now - self.bpm_start_time)
+            else:
+                self.beat += (now - self.last_now_call) * (self.get_bpm() / 60)
             self.last_now_call = now
         return self.beat
 
     def now(self):
-        """ Returns the total elapsed time (in beats as opposed to seconds) """
+        """ Returns the total elapsed time (in beats as opposed to seconds). In lookahead
+            mode, queue blocks see the beat they are due instead, and when previewing a
+            player's events the beat of the event being previewed is used """
+        beat = getattr(self.render, "preview", None)
+        if beat is not None:
+            return float(beat)
+        if self.lookahead > 0:
+            beat = getattr(self.render, "beat", None)
+            if beat is not None:
+                return float(beat)
         if self.ticking is False: # Get the time w/o latency if not ticking
             self.beat = self._now()
         return float(self.beat)
@@ -509,10 +991,21 @@ class TempoClock(object):
 
     def osc_message_time(self):
         """ Returns the true time that an osc message should be run i.e. now + latency """
-        return time.time() + self.latency
+        if self.lookahead > 0:
+            timestamp = getattr(self.render, "time", None)
+            if timestamp is not None:
+                return timestamp
+        return self.get_machine_time() + self.latency
         
     def start(self):
-        """ Starts the clock thread """ 
+        """ Starts the clock thread, and the thread sending bundles in lookahead mode """
+        if self.lookahead > 0:
+            self.sender.start()
+        if self.thread.is_alive() or self.time_source.manual:
+            return
+        if self.thread.ident is not None:
+            self.thread = threading.Thread(target=self.run)
+        self.executor.start()
         self.thread.daemon = True
         self.thread.start()
         return
@@ -542,309 +1035,703 @@ class TempoClock(object):
         """ Start recursive call to adjust hard-nudge values """
         return self.schedule(self._adjust_hard_nudge)
 
-    def __run_block(self, block, beat):
+    def __run_block(self, block, beat, dispatched):
         """ Private method for calling all the items in the queue block.
-            This means the clock can still 'tick' while a large number of
-            events are activated  """
+            This is called by one of the clock's worker threads, so the
+            clock can still 'tick' while a large number of events are
+            activated. `dispatched` is the time the block was handed to
+            the workers """
+
+        # A late block calls any other overdue blocks when using the "coalesce" late policy
+
+        if block.catch_up is not None:
+
+            until, block.catch_up = block.catch_up, None
+
+            return self.__catch_up(block, beat, dispatched, until)
 
         # Set the time to "activate" messages on - adjust in case the block is activated late
 
         # `beat` is the actual beat this is happening, `block.beat` is the desired time. Adjust
-        # the osc_message_time accordingly if this is being called late
+        # the osc_message_time accordingly if this is being called late. Time spent waiting for
+        # a free worker is not added on to the timestamp.
 
-        block.time = self.osc_message_time() - self.beat_dur(float(beat) - block.beat)
+        if block.late_time is None:
 
-        for item in block:
+            block.time = (dispatched + self.latency) - self.beat_dur(float(beat) - block.beat)
 
-            # The item might get called by another item in the queue block
+        else:
 
-            output = None
+            block.time = block.late_time
 
-            if item.called is False:
+        # How late the block is being called, including time spent waiting for a worker
 
-                try:
+        lateness = self.beat_dur(float(beat) - block.beat) + self.lookahead + (self.get_machine_time() - dispatched)
 
-                    output = item.__call__()
+        start = self.block_stats.timer()
 
-                except SystemExit:
+        # Let the items use the block's beat as the current time if called ahead of time
 
-                    sys.exit()
+        rendering = self.lookahead > 0
 
-                except:
+        profiler = self.profiler
 
-                    print(error_stack())
+        if rendering:
 
-                # TODO: Get OSC message from the call, and add to list?
+            self.render.beat = block.beat
+            self.render.time = block.time
 
-        # Send all the message to supercollider together
+        try:
 
-        block.send_osc_messages()
+            for item in block:
 
-        # Store the osc messages -- future idea
+                # The item might get called by another item in the queue block
 
-        # self.history.add(block.beat, block.osc_messages)
+                output = None
 
-        return
+                if item.called is False:
 
-    def run(self):
-        """ Main loop """
-        
-        self.ticking = True
+                    if rendering:
 
-        self.polled = False
+                        self.render.item = item.obj
 
-        while self.ticking:
+                    try:
 
-            beat = self._now() # get current time
+                        if profiler is None:
 
-            if self.queue.after_next_event(beat):
+                            output = item.__call__()
 
-                self.current_block = self.queue.pop()
+                        else:
 
-                # Do the work in a thread
+                            item_start = profiler.timer()
 
-                if len(self.current_block):
+                            output = item.__call__()
 
-                    threading.Thread(target=self.__run_block, args=(self.current_block, beat)).start()
+                            profiler.add(item.obj, block.beat, profiler.timer() - item_start)
 
-            # If using a midi-clock, update the values
+                    except SystemExit:
 
-            if self.midi_clock is not None:
+                        sys.exit()
 
-                self.midi_clock.update()
+                    except:
 
-            # if using espgrid
+                        print(error_stack())
 
-            if self.sleep_time > 0:
+                    # TODO: Get OSC message from the call, and add to list?
 
-                time.sleep(self.sleep_time)
+        finally:
 
-        return
+            if rendering:
 
-    def schedule(self, obj, beat=None, args=(), kwargs={}, is_priority=False):
-        """ TempoClock.schedule(callable, beat=None)
-            Add a player / event to the queue """
+                self.render.beat = self.render.time = self.render.item = None
 
-        # Make sure the object can actually be called
+        # Send all the message to supercollider together
 
-        try:
+        block.send_osc_messages()
 
-            assert callable(obj)
+        # Store the osc messages so they can be re-sent if the clock is moved back. Blocks
+        # replaying the history send theirs directly, so they don't replace what was stored
 
-        except AssertionError:
+        if len(block.osc_messages) > 0 and self._replay_history not in block:
 
-            raise ScheduleError(obj)
+            self.history.add(block.beat, block.time, block.osc_messages)
 
-        # Start the clock ticking if not already
+        self.block_stats.add_block(lateness, self.block_stats.timer() - start, len(block))
 
-        if self.ticking == False:
+        return
 
-            self.start()
+    def __catch_up(self, block, beat, dispatched, until):
+        """ Calls `block` and then each block due before `until`, including any scheduled
+            while doing so, without sending any OSC messages. Used by the "coalesce" late
+            policy on the thread the late block was given to """
 
-        # Default is next bar
+        try:
 
-        if beat is None:
+            while True:
 
-            beat = self.next_bar()
+                self.__run_block(block, beat, dispatched)
 
-        # Keep track of objects in the Clock
+                self.block_stats.add_late("coalesced")
 
-        if obj not in self.playing and isinstance(obj, Player):
+                if self.next_event() > until:
 
-            self.playing.append(obj)
+                    break
 
-        if obj not in self.items:
+                block = self.pop_block()
 
-            self.items.append(obj)
+                block.silent = True
 
-        # Add to the queue
+                dispatched = self.get_machine_time()
 
-        self.queue.add(obj, beat, args, kwargs, is_priority)
+        finally:
 
-        # block.time = self.osc_message_accum
+            self.catching_up = False
 
-        return
+            self.notify()
+
+        self.block_stats.add_late("catch_up_passes")
 
-    def future(self, dur, obj, args=(), kwargs={}):
-        """ Add a player / event to the queue `dur` beats in the future """
-        self.schedule(obj, self.now() + dur, args, kwargs)
         return
 
-    def next_bar(self):
-        """ Returns the beat value for the start of the next bar """
-        beat = self.now()
-        return beat + (self.meter[0] - (beat % self.meter[0]))
+    def render_nrt(self, filename, beats=None, seconds=None):
+        """ Renders the clock's queue to a SuperCollider non-realtime score file instead
+            of playing it. Queue blocks are called in order using a virtual clock, as fast
+            as possible, until `beats` beats or `seconds` seconds have been rendered. The
+            score can be turned into audio using `scsynth -N` and the NRTScore instance
+            is returned so that the bundles can also be inspected directly. Afterwards the
+            clock carries on playing from the end of the render e.g.
 
-    def next_event(self):
-        """ Returns the beat index for the next event to be called """
-        return self.queue[-1][1]
+                Clock.render_nrt("score.osc", beats=64)
 
-    def call(self, obj, dur, args=()):
-        """ Returns a 'schedulable' wrapper for any callable object """
-        return Wrapper(self, obj, dur, args)
+            The score needs the SynthDefs FoxDot uses, which are stored by SuperCollider
+            when FoxDot starts, but not the samples as the buffers are loaded at time 0. """
 
-    def players(self, ex=[]):
-        return [p for p in self.playing if p not in exclude]
+        if beats is None and seconds is None:
 
-    # Every n beats, do...
+            raise ValueError("Please specify the number of beats or seconds to render")
 
-    def every(self, n, cmd, args=()):
-        def event(f, n, args):
-            f(*args)
-            self.schedule(event, self.now() + n, (f, n, args))
-            return
-        self.schedule(event, self.now() + n, args=(cmd, n, args))
-        return
+        ticking, time_source = self.ticking, self.time_source
 
-    def stop(self):
-        self.ticking = False
-        self.kill_tempo_server()
-        self.kill_tempo_client()
-        self.clear()
-        return
+        self.set_time_source(ManualTime())
 
-    def shift(self, n):
-        """ Offset the clock time """
-        self.beat += n
-        return
+        lookahead, self.lookahead = self.lookahead, 0
 
-    def clear(self):
-        """ Remove players from clock """
+        start_time = self.time_source.time()
 
-        self.items = []
-        self.queue.clear()
-        self.solo.reset()
+        self.score = NRTScore(start_time)
 
-        for player in list(self.playing):
+        try:
 
-            player.kill()
+            for buf in Player.samples.getLoadedBuffers():
 
-        # for item in self.items:
+                self.score.add_message(0, "/b_allocRead", [buf.bufnum, buf.fn])
 
-        #     if hasattr(item, 'stop'):
+            self.step(beats, seconds)
 
-        #         item.stop()
-        
-        self.playing = []
+            score = self.score
 
-        if self.espgrid is not None:
+            duration = self.time_source.time() - start_time + self.latency
 
-            self.schedule(self._espgrid_update_tempo)
-        
-        return
+        finally:
 
-#####
+            self.score = None
 
-class Queue(object):
-    def __init__(self, parent):
-        self.data = []
-        self.parent = parent
+            self.lookahead = lookahead
 
-    def __repr__(self):
-        return "\n".join([str(item) for item in self.data]) if len(self.data) > 0 else "[]"
+            # Carry on in real-time from the end of the render
 
-    def add(self, item, beat, args=(), kwargs={}, is_priority=False):
-        """ Adds a callable object to the queue at a specified beat, args and kwargs for the
-            callable object must be in a list and dict.
-        """
-        
-        # item must be callable to be schedule, so check args and kwargs are appropriate for it
+            self.set_time_source(time_source)
 
-        try:
+        score.write(filename, duration)
 
-            function = inspect.getargspec(item)
+        if ticking:
 
-        except TypeError:
+            self.start()
 
-            function = inspect.getargspec(item.__call__)
+        return score
 
-        # If the item can't take arbitrary keywords, check any kwargs are valid
+    def step(self, beats=None, seconds=None):
+        """ Moves a clock using a `ManualTime` time source forward by `beats` or `seconds`
+            and calls the queue blocks that are due on the way, in order, without sleeping.
+            Returns the number of blocks called. """
 
-        if function.keywords is None: 
+        if not self.time_source.manual:
 
-            for key in list(kwargs.keys()):
+            raise TypeError("Clock.step can only be used with a ManualTime time source")
 
-                if key not in function.args:
+        end_beat = self._now() + beats if beats is not None else None
 
-                    del kwargs[key]
+        end_time = self.time_source.time() + seconds if seconds is not None else None
 
-        # If the new event is before the next scheduled event,
-        # move it to the 'front' of the queue
+        num_blocks = 0
 
-        if self.before_next_event(beat):
+        while len(self.queue) or len(self.wheel):
 
-            self.data.append(QueueBlock(self, item, beat, args, kwargs, is_priority))
+            next_beat = self.next_event()
 
-            block = self.data[-1]
+            if end_beat is not None and next_beat > end_beat:
 
-        else:
+                break
 
-            # If the event is after the next scheduled event, work
-            # out its position in the queue
+            # Time of the next block, allowing for nudge values
 
-            # need to be careful in case self.data changes size
-            
-            for block in self.data:
+            next_time = self.time_source.time() + self.get_time_at_beat(next_beat) - self.get_time()
 
-                # If another event is happening at the same time, schedule together
+            if end_time is not None and next_time > end_time:
 
-                if beat == block.beat:
+                break
 
-                    block.add(item, args, kwargs, is_priority)
+            self.time_source.set(max(next_time, self.time_source.time()))
 
-                    break
+            beat = self._now()
 
-                # If the event is later than the next event, schedule it here
+            block = self.pop_block()
 
-                if beat > block.beat:
+            if len(block) and self.handle_late_block(block, beat):
 
-                    try:
+                self.__run_block(block, beat, self.time_source.time())
 
-                        i = self.data.index(block)
+                num_blocks += 1
 
-                    except ValueError:
+        if end_beat is not None:
 
-                        i = 0
+            self.time_source.step(max(0, self.get_time_at_beat(end_beat) - self.get_time()))
 
-                    self.data.insert(i, QueueBlock(self, item, beat, args, kwargs, is_priority))
+        else:
 
-                    block = self.data[i]
+            self.time_source.set(max(end_time, self.time_source.time()))
 
-                    break
+        self.beat = self._now()
 
-        # Tell any players about what queue item they are in
+        return num_blocks
 
-        if isinstance(item, Player):
+    def run(self):
+        """ Main loop """
+        
+        self.ticking = True
 
-            item.set_queue_block(block)
+        self.polled = False
 
-        return
+        while self.ticking:
 
-    def clear(self):
-        while len(self.data):
-            del self.data[-1]
-        return
+            beat = self._now() # get current time
 
-    def pop(self):
-        return self.data.pop() if len(self.data) > 0 else list()
+            if not self.catching_up and self.next_event() <= beat + self.get_lookahead():
 
-    def next(self):
-        if len(self.data) > 0:
-            try:
-                return self.data[-1].beat
-            except IndexError:
-                pass
-        return sys.maxsize
+                self.current_block = self.pop_block()
 
-    def before_next_event(self, beat):
-        try:
-            return beat < self.data[-1].beat
-        except IndexError:
-            return True
+                # Hand the work to the worker threads
+
+                if len(self.current_block):
+
+                    self.loop_stats.add_wake_error(self.get_time() + self.lookahead - self.get_time_at_beat(self.current_block.beat))
+
+                    if self.handle_late_block(self.current_block, beat) and self.handle_overload(self.current_block, beat):
+
+                        self.executor.submit(self.current_block, beat)
+
+            # If using a midi-clock, update the values
+
+            if self.midi_clock is not None:
+
+                self.midi_clock.update()
+
+            # if using espgrid
+
+            self.wait_for_next_block()
+
+            self.loop_stats.tick()
+
+        return
+
+    def wait_for_next_block(self):
+        """ Sleeps until the next block in the queue is due. Midi clocks need to be
+            updated continually so the clock polls if one is being used """
+
+        if self.polling or self.midi_clock is not None:
+
+            if self.sleep_time > 0:
+
+                time.sleep(self.sleep_time)
+
+            return
+
+        if self.catching_up:
+
+            # Wait for a late block to finish calling the overdue blocks
+
+            with self.wake:
+
+                if self.catching_up:
+
+                    self.wake.wait(self.max_sleep_time)
+
+            return
+
+        with self.wake:
+
+            # An empty queue returns sys.maxsize so this sleeps for max_sleep_time
+
+            deadline  = self.get_time_at_beat(self.next_event()) - self.lookahead
+            remaining = deadline - self.get_time()
+
+            if remaining > self.spin_time:
+
+                # Cap the sleep in case a TimeVar bpm or nudge has changed the deadline
+
+                self.wake.wait(min(remaining - self.spin_time, self.max_sleep_time))
+
+                return
+
+        # Close to the deadline: yield to other threads until it has passed
+
+        while self.ticking and self.get_time() < deadline:
+
+            time.sleep(0)
+
+        return
+
+    def schedule(self, obj, beat=None, args=(), kwargs={}, is_priority=False):
+        """ TempoClock.schedule(callable, beat=None)
+            Add a player / event to the queue """
+
+        # Make sure the object can actually be called
+
+        try:
+
+            assert callable(obj)
+
+        except AssertionError:
+
+            raise ScheduleError(obj)
+
+        # Start the clock ticking if not already
+
+        if self.ticking == False:
+
+            self.start()
+
+        # Default is next bar
+
+        if beat is None:
+
+            beat = self.next_bar()
+
+        # Keep track of objects in the Clock
+
+        if obj not in self.playing and isinstance(obj, Player):
+
+            self.playing.append(obj)
+
+        if obj not in self.items:
+
+            self.items.append(obj)
+
+        # Add to the queue and wake the clock if this is now the next event
+
+        next_beat = self.next_event()
+
+        self.queue.add(obj, beat, args, kwargs, is_priority)
+
+        if beat < next_beat:
+
+            self.notify()
+
+        # block.time = self.osc_message_accum
+
+        return
+
+    def schedule_timer(self, obj, beat, args=(), kwargs={}):
+        """ Adds a callable object to the clock's timer wheel, which is used for
+            repeated calls such as `every` as it costs less than the queue. It is
+            called in the same queue block as any other objects scheduled at `beat` """
+
+        if self.ticking == False:
+
+            self.start()
+
+        next_beat = self.next_event()
+
+        self.wheel.add(obj, beat, args, kwargs)
+
+        if beat < next_beat:
+
+            self.notify()
+
+        return
+
+    def timer_done(self, obj):
+        """ Tells the timer wheel that `obj` was called and has not been scheduled again """
+
+        self.wheel.done(obj)
+
+        return
+
+    def pop_block(self):
+        """ Removes and returns the next queue block, or an empty list if there are none.
+            Objects in the timer wheel due at the same beat are added to the block """
+
+        beat = self.next_event()
+
+        block = self.queue.pop() if self.queue.next() == beat else None
+
+        for obj, args, kwargs in self.wheel.pop(beat):
+
+            if block is None:
+
+                block = QueueBlock(self.queue, obj, beat, args, kwargs)
+
+            else:
+
+                block.add(obj, args, kwargs)
+
+        return block if block is not None else list()
+
+    def future(self, dur, obj, args=(), kwargs={}):
+        """ Add a player / event to the queue `dur` beats in the future """
+        self.schedule(obj, self.now() + dur, args, kwargs)
+        return
+
+    def next_bar(self):
+        """ Returns the beat value for the start of the next bar """
+        beat = self.now()
+        return beat + (self.meter[0] - (beat % self.meter[0]))
+
+    def next_event(self):
+        """ Returns the beat index for the next event to be called """
+        return min(self.queue.next(), self.wheel.next())
+
+    def call(self, obj, dur, args=()):
+        """ Returns a 'schedulable' wrapper for any callable object """
+        return Wrapper(self, obj, dur, args)
+
+    def players(self, ex=[]):
+        return [p for p in self.playing if p not in exclude]
+
+    # Every n beats, do...
+
+    def every(self, n, cmd, args=()):
+        def event(f, n, args):
+            f(*args)
+            self.schedule_timer(event, self.now() + n, (f, n, args))
+            return
+        self.schedule_timer(event, self.now() + n, args=(cmd, n, args))
+        return
+
+    def stop(self):
+        self.ticking = False
+        self.kill_tempo_server()
+        self.kill_tempo_client()
+        self.clear()
+        self.executor.shutdown()
+        self.sender.stop()
+        return
+
+    def shift(self, n):
+        """ Offset the clock time by `n` beats. Anything scheduled other than players, such
+            as functions and `every` calls, is moved by `n` beats too so that it is still due
+            the same number of beats from now """
+
+        items = [(block.beat, item) for block in self.queue for item in block if not isinstance(item.obj, Player)]
+
+        timers = self.wheel.items()
+
+        self.set_time(self.now() + n)
+
+        for beat, item in items:
+
+            self.queue.add(item.obj, beat + n, item.args, item.kwargs)
+
+        for beat, obj, args, kwargs in timers:
+
+            self.wheel.add(obj, beat + n, args, kwargs)
+
+        self.notify()
+
+        return
+
+    def clear(self):
+        """ Remove players from clock """
+
+        self.items = []
+        self.queue.clear()
+        self.wheel.clear()
+        self.sender.clear()
+        self.history.clear()
+        self.solo.reset()
+        self.catching_up = False
+
+        for player in list(self.playing):
+
+            player.kill()
+
+        # for item in self.items:
+
+        #     if hasattr(item, 'stop'):
+
+        #         item.stop()
+        
+        self.playing = []
+
+        if self.espgrid is not None:
+
+            self.schedule(self._espgrid_update_tempo)
+        
+        return
+
+#####
+
+class TempoMap(object):
+    """ Converts between beats and seconds for a tempo that changes over time. Each
+        segment has a constant tempo, or for a `linvar` tempo a linear change to the
+        next value, and the beats and seconds at the start of each segment are stored
+        so that converting is a binary search. The segments repeat every `period`
+        beats and `offset` is the beat the first segment starts on. """
+
+    def __init__(self, values, durs, ramp=False, offset=0):
+        self.values = values
+        self.durs   = durs
+        self.ramp   = ramp
+        self.offset = offset
+        self.beats   = [0.0]
+        self.seconds = [0.0]
+        for i, dur in enumerate(durs):
+            self.beats.append(self.beats[-1] + dur)
+            self.seconds.append(self.seconds[-1] + self.get_segment_seconds(i, dur))
+        self.period   = self.beats[-1]
+        self.duration = self.seconds[-1]
+
+    @classmethod
+    def from_timevar(cls, bpm):
+        """ Returns a TempoMap for a `var` or `linvar` bpm, or None if the tempo
+            can't be calculated exactly e.g. if it has an `inf` duration """
+        if type(bpm) not in (TimeVar, linvar) or bpm.dependency is not None or bpm.bpm is not None:
+            return None
+        try:
+            values = [float(value) for value in bpm.values]
+            durs   = [dur for dur in bpm.dur]
+            if len(values) == 0 or any([dur == inf for dur in durs]):
+                return None
+            durs = [float(dur) for dur in durs]
+        except (TypeError, ValueError):
+            return None
+        # Values and durations of different lengths repeat together
+        size = LCM(len(values), len(durs))
+        values = [values[i % len(values)] for i in range(size + 1)]
+        durs   = [durs[i % len(durs)] for i in range(size)]
+        if min(values) <= 0 or min(durs) < 0 or sum(durs) <= 0:
+            return None
+        return cls(values, durs, ramp=isinstance(bpm, linvar), offset=bpm.start_time)
+
+    def get_segment_seconds(self, i, beats):
+        """ Returns the time taken, in seconds, for the first `beats` beats of segment `i` """
+        start = self.values[i]
+        if self.ramp and self.values[i + 1] != start and self.durs[i] > 0:
+            change = (self.values[i + 1] - start) / self.durs[i]
+            return 60.0 * math.log((start + change * beats) / start) / change
+        return 60.0 * beats / start
+
+    def get_segment_beats(self, i, seconds):
+        """ Returns the number of beats into segment `i` after `seconds` seconds """
+        start = self.values[i]
+        if self.ramp and self.values[i + 1] != start and self.durs[i] > 0:
+            change = (self.values[i + 1] - start) / self.durs[i]
+            return start * (math.exp(change * seconds / 60.0) - 1) / change
+        return seconds * start / 60.0
+
+    def get_seconds(self, beat):
+        """ Returns the time in seconds at `beat`, measured from the start of the first segment """
+        cycles, beat = divmod(float(beat) - self.offset, self.period)
+        i = min(bisect.bisect_right(self.beats, beat) - 1, len(self.durs) - 1)
+        return (cycles * self.duration) + self.seconds[i] + self.get_segment_seconds(i, beat - self.beats[i])
+
+    def get_beat(self, seconds):
+        """ Returns the beat at `seconds` seconds from the start of the first segment """
+        cycles, seconds = divmod(float(seconds), self.duration)
+        i = min(bisect.bisect_right(self.seconds, seconds) - 1, len(self.durs) - 1)
+        return self.offset + (cycles * self.period) + self.beats[i] + self.get_segment_beats(i, seconds - self.seconds[i])
+
+    def get_bpm(self, beat):
+        """ Returns the tempo at `beat` """
+        beat = (float(beat) - self.offset) % self.period
+        i = min(bisect.bisect_right(self.beats, beat) - 1, len(self.durs) - 1)
+        if self.ramp and self.durs[i] > 0:
+            return self.values[i] + (self.values[i + 1] - self.values[i]) * (beat - self.beats[i]) / self.durs[i]
+        return self.values[i]
+
+class Queue(object):
+    """ Holds the `QueueBlock` instances waiting to be called by the clock. The beat
+        values are kept in a heap so the next block can be found and removed in
+        O(log n) time, and each beat maps to its block in `self.data` so that
+        objects scheduled for the same beat are merged without a search """
+    def __init__(self, parent):
+        self.data = {} # beat -> QueueBlock
+        self.heap = [] # beat values
+        self.parent = parent
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return "\n".join([str(item) for item in self]) if len(self.heap) > 0 else "[]"
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __iter__(self):
+        """ Iterates over the queue blocks in the order they will be called """
+        with self.lock:
+            blocks = [self.data[beat] for beat in sorted(self.heap)]
+        for block in blocks:
+            yield block
+
+    def add(self, item, beat, args=(), kwargs={}, is_priority=False):
+        """ Adds a callable object to the queue at a specified beat, args and kwargs for the
+            callable object must be in a list and dict.
+        """
+        
+        # item must be callable to be schedule, so check args and kwargs are appropriate for it
+
+        info = CallableInfo.get(item)
+
+        # If the item can't take arbitrary keywords, check any kwargs are valid
+
+        if len(kwargs) and not info.keywords:
+
+            kwargs = dict((key, value) for key, value in kwargs.items() if key in info.args)
+
+        with self.lock:
+
+            # If another event is happening at the same time, schedule together
+
+            block = self.data.get(beat, None)
+
+            if block is not None:
+
+                block.add(item, args, kwargs, is_priority, info.priority)
+
+            else:
+
+                block = QueueBlock(self, item, beat, args, kwargs, is_priority, info.priority)
+
+                self.data[beat] = block
+
+                heapq.heappush(self.heap, beat)
+
+        # Tell any players about what queue item they are in
+
+        if isinstance(item, Player):
+
+            item.set_queue_block(block)
+
+        return
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            del self.heap[:]
+        return
+
+    def pop(self):
+        """ Removes and returns the next queue block, or an empty list if there are none """
+        with self.lock:
+            if len(self.heap) == 0:
+                return list()
+            return self.data.pop(heapq.heappop(self.heap))
+
+    def next(self):
+        try:
+            return self.heap[0]
+        except IndexError:
+            return sys.maxsize
+
+    def before_next_event(self, beat):
+        try:
+            return beat < self.heap[0]
+        except IndexError:
+            return True
 
     def after_next_event(self, beat):
         try:
-            return beat >= self.data[-1].beat
+            return beat >= self.heap[0]
         except IndexError:
             return False
 
@@ -855,7 +1742,234 @@ class Queue(object):
     def get_clock(self):
         return self.parent
             
-from types import FunctionType
+class CallableInfo(object):
+    """ Describes how the queue calls an object: the names of the keyword arguments
+        it accepts and the priority level of the `QueueBlock` it is added to. These
+        are cached by the type of the object and the code object that calling it
+        runs, so re-defining a function or a class's `__call__` method while live
+        coding creates a new entry instead of using the old signature. """
+
+    cache = {}
+    max_cache_size = 4096
+
+    def __init__(self, item, function):
+        try:
+            spec = getargspec(function)
+        except TypeError:
+            # Can't inspect e.g. builtins so pass on any keywords
+            self.args = ()
+            self.keywords = True
+        else:
+            self.args = frozenset(spec.args + getattr(spec, "kwonlyargs", []))
+            self.keywords = spec[2] is not None # varkw / keywords
+        self.priority = QueueBlock.get_priority_level(item)
+
+    def __repr__(self):
+        return "<CallableInfo args={} keywords={} priority={}>".format(sorted(self.args), self.keywords, self.priority)
+
+    @classmethod
+    def get(cls, item):
+        """ Returns the `CallableInfo` for a scheduled object, using the cache if possible """
+
+        if isinstance(item, (FunctionType, MethodType)):
+            function = item
+        else:
+            function = getattr(type(item), "__call__", item)
+
+        code = getattr(getattr(function, "__func__", function), "__code__", None)
+
+        # Don't cache objects without Python code e.g. functools.partial
+
+        if code is None:
+            return cls(item, item if function is item else item.__call__)
+
+        key = (type(item), code)
+
+        try:
+            return cls.cache[key]
+        except KeyError:
+            pass
+
+        info = cls(item, item if function is item else item.__call__)
+
+        if len(cls.cache) >= cls.max_cache_size:
+            cls.cache.clear()
+
+        cls.cache[key] = info
+
+        return info
+
+    @classmethod
+    def clear_cache(cls):
+        cls.cache.clear()
+        return
+
+class TimerWheel(object):
+    """ Hierarchical timer wheel used by the `TempoClock` for objects that are called
+        repeatedly. Beats are divided into `resolution` ticks and each of the `levels`
+        wheels has `2 ** bits` slots, each covering `2 ** bits` slots of the level
+        below. Adding an object puts it straight into a slot and, as the clock moves
+        on, the slots of higher levels are moved down a level when they are reached
+        so adding and removing objects does not depend on how many are scheduled.
+        Objects in the current tick are kept in a small heap to keep them in order. """
+
+    def __init__(self, resolution=16, bits=6, levels=3):
+        self.resolution = resolution
+        self.bits  = bits
+        self.mask  = (1 << bits) - 1
+        self.wheels = [[[] for n in range(1 << bits)] for level in range(levels)]
+        self.overflow = [] # beyond the range of the highest level
+        self.current  = [] # heap of (beat, n, obj, args, kwargs) at or before `tick`
+        self.tick  = 0
+        self.count = 0 # number of items in `wheels` and `overflow`
+        self.sizes = [0 for level in range(levels)]
+        self.counter = 0 # keeps objects added at the same beat in order
+        self.objects = {} # obj -> number of times it is in the wheel
+        self.running = {} # obj -> number of times it has been popped but not added again
+        self.lock  = threading.Lock()
+
+    def __len__(self):
+        return self.count + len(self.current)
+
+    def __contains__(self, obj):
+        """ Objects that have been popped count as scheduled until they are added again
+            or marked as `done`, so they are not scheduled twice while being called """
+        try:
+            return obj in self.objects or obj in self.running
+        except TypeError:
+            return False
+
+    def get_tick(self, beat):
+        return int(beat * self.resolution)
+
+    def add(self, obj, beat, args=(), kwargs={}):
+        """ Adds `obj` to be called with `args` and `kwargs` at `beat` """
+        with self.lock:
+            self.counter += 1
+            self.objects[obj] = self.objects.get(obj, 0) + 1
+            self._remove_running(obj)
+            self._insert((beat, self.counter, obj, args, kwargs))
+        return
+
+    def _insert(self, entry):
+        """ Puts an entry in the slot for its tick relative to the current tick """
+        tick = self.get_tick(entry[0])
+        if tick <= self.tick:
+            heapq.heappush(self.current, entry)
+            return
+        for level, wheel in enumerate(self.wheels):
+            shift = self.bits * (level + 1)
+            if (tick >> shift) == (self.tick >> shift):
+                wheel[(tick >> (self.bits * level)) & self.mask].append(entry)
+                self.sizes[level] += 1
+                break
+        else:
+            self.overflow.append(entry)
+        self.count += 1
+        return
+
+    def _cascade(self, level, index):
+        """ Re-inserts the entries in a slot relative to the current tick """
+        if level == len(self.wheels):
+            entries, self.overflow = self.overflow, []
+        else:
+            entries = self.wheels[level][index]
+            self.wheels[level][index] = []
+            self.sizes[level] -= len(entries)
+        self.count -= len(entries)
+        for entry in entries:
+            self._insert(entry)
+        return
+
+    def _advance(self, tick):
+        """ Moves the current tick forward to `tick`, moving any entries in the
+            slots passed on the way into the current heap """
+        while self.tick < tick:
+            if self.count == 0:
+                self.tick = tick
+                break
+            # Skip to the end of the current range of any empty levels
+            end = self.tick
+            for level in range(len(self.wheels)):
+                if self.sizes[level] > 0:
+                    break
+                shift = self.bits * (level + 1)
+                end = ((self.tick >> shift) + 1 << shift) - 1
+            if end > self.tick:
+                self.tick = min(end, tick)
+                continue
+            self.tick += 1
+            # Move slots in higher levels down a level when their range is reached
+            for level in range(len(self.wheels), -1, -1):
+                if self.tick & ((1 << (self.bits * level)) - 1) == 0:
+                    self._cascade(level, (self.tick >> (self.bits * level)) & self.mask)
+        return
+
+    def next(self):
+        """ Returns the beat of the next object to be called or sys.maxsize """
+        with self.lock:
+            if self.current:
+                return self.current[0][0]
+            if self.count == 0:
+                return sys.maxsize
+            # The first slot in use at the lowest level holds the earliest entries
+            for level, wheel in enumerate(self.wheels):
+                start = ((self.tick >> (self.bits * level)) & self.mask) + 1
+                for index in range(start, len(wheel)):
+                    if wheel[index]:
+                        return min([entry[0] for entry in wheel[index]])
+            return min([entry[0] for entry in self.overflow])
+
+    def pop(self, beat):
+        """ Removes and returns a list of (obj, args, kwargs) for objects due at or before `beat` """
+        items = []
+        with self.lock:
+            self._advance(self.get_tick(beat))
+            while self.current and self.current[0][0] <= beat:
+                entry = heapq.heappop(self.current)
+                obj = entry[2]
+                if self.objects[obj] > 1:
+                    self.objects[obj] -= 1
+                else:
+                    del self.objects[obj]
+                self.running[obj] = self.running.get(obj, 0) + 1
+                items.append((obj, entry[3], entry[4]))
+        return items
+
+    def done(self, obj):
+        """ Marks a popped object that is not being added again as no longer scheduled """
+        with self.lock:
+            self._remove_running(obj)
+        return
+
+    def _remove_running(self, obj):
+        if obj in self.running:
+            if self.running[obj] > 1:
+                self.running[obj] -= 1
+            else:
+                del self.running[obj]
+        return
+
+    def items(self):
+        """ Returns a list of (beat, obj, args, kwargs) for every object in the wheel, in the
+            order they will be called """
+        with self.lock:
+            entries = self.current + self.overflow + [entry for wheel in self.wheels for slot in wheel for entry in slot]
+        return [(entry[0], entry[2], entry[3], entry[4]) for entry in sorted(entries, key=lambda entry: entry[:2])]
+
+    def clear(self):
+        with self.lock:
+            for wheel in self.wheels:
+                for slot in wheel:
+                    del slot[:]
+            del self.overflow[:]
+            del self.current[:]
+            self.objects.clear()
+            self.running.clear()
+            self.count = 0
+            self.sizes = [0 for level in self.wheels]
+        return
+
 class QueueBlock(object):
     priority_levels = [
                         lambda x: type(x) in (FunctionType, MethodType),   # Any functions are called first
@@ -864,7 +1978,7 @@ class QueueBlock(object):
                         lambda x: True                       # And anything else
                       ]
                        
-    def __init__(self, parent, obj, t, args=(), kwargs={}, is_priority=False): # Why am I forcing an obj?
+    def __init__(self, parent, obj, t, args=(), kwargs={}, is_priority=False, level=None): # Why am I forcing an obj?
 
         self.events         = [ [] for lvl in self.priority_levels ]
         self.called_events  = []
@@ -879,7 +1993,14 @@ class QueueBlock(object):
 
         self.beat = t
         self.time = 0
-        self.add(obj, args, kwargs, is_priority)
+
+        # Set by the clock's late policy: send no OSC messages, send them at `late_time`, or
+        # call the overdue blocks due before the `catch_up` beat after this one
+        self.silent = False
+        self.late_time = None
+        self.catch_up = None
+
+        self.add(obj, args, kwargs, is_priority, level)
 
     @classmethod
     def set_server(cls, server):
@@ -892,28 +2013,35 @@ class QueueBlock(object):
     def __repr__(self):
         return "{}: {}".format(self.beat, self.players())
     
-    def add(self, obj, args=(), kwargs={}, is_priority=False):
-        """ Adds a callable object to the QueueBlock """
+    @classmethod
+    def get_priority_level(cls, obj):
+        """ Returns the index of the first priority level `obj` belongs to """
+        for i, in_level in enumerate(cls.priority_levels):
+            if in_level(obj):
+                return i
+
+    def add(self, obj, args=(), kwargs={}, is_priority=False, level=None):
+        """ Adds a callable object to the QueueBlock. `level` is the object's
+            priority level, which is looked up if not given """
 
         q_obj = QueueObj(obj, args, kwargs)
 
-        for i, in_level in enumerate(self.priority_levels):
+        if level is None:
 
-            if in_level(obj):
+            level = CallableInfo.get(obj).priority
 
-                # Put at the front if labelled as priority
+        # Put at the front if labelled as priority
 
-                if is_priority:
+        if is_priority:
 
-                    self.events[i].insert(0, q_obj)
+            self.events[level].insert(0, q_obj)
 
-                else:
+        else:
 
-                    self.events[i].append(q_obj)
+            self.events[level].append(q_obj)
 
-                self.items[q_obj.obj] = q_obj # store the wrapped object as an identifer
+        self.items[q_obj.obj] = q_obj # store the wrapped object as an identifer
 
-                break
         return
 
     def __call__(self):
@@ -921,13 +2049,26 @@ class QueueBlock(object):
         self.send_osc_messages()
 
     def append_osc_message(self, message):
-        """ Adds an OSC bundle if the timetag is not in the past """
+        """ Adds an OSC bundle if the timetag is not in the past. In lookahead mode
+            the bundle is given to the clock's `BundleSender` straight away """
+        if self.silent:
+            return
         if message.timetag > self.metro.get_time():
-            self.osc_messages.append(message)
+            if self.metro.lookahead > 0:
+                self.metro.sender.add(message, self.metro.get_render_source())
+            else:
+                self.osc_messages.append(message)
+        else:
+            self.metro.block_stats.add_dropped()
         return
 
     def send_osc_messages(self):
-        """ Sends all compiled osc messages to the SuperCollider server """
+        """ Sends all compiled osc messages to the SuperCollider server, or adds
+            them to the clock's score if rendering in non-realtime """
+        if self.metro.score is not None:
+            return list(map(self.metro.score.sendOSC, self.osc_messages))
+        if self.metro.packer is not None:
+            return list(map(self.server.sendOSC, self.metro.packer.pack(self.osc_messages)))
         return list(map(self.server.sendOSC, self.osc_messages))
 
     def players(self):
@@ -970,16 +2111,821 @@ class QueueObj(object):
         self.called = True
         return value
 
+class BlockExecutor(object):
+    """ Fixed-size pool of threads owned by a `TempoClock` that call queue blocks
+        in the order they are submitted, instead of starting a new thread for
+        every block. `func` is called with the block, the beat it was activated
+        on, and the time it was submitted, which is read from `timer`. A clock
+        uses its time source so the time can be compared with its own """
+    def __init__(self, func, workers=1, timer=time.time):
+        self.func    = func
+        self.timer   = timer
+        self.tasks   = queue.Queue()
+        self.threads = []
+        self.lock    = threading.Lock()
+        self.num_workers = int(workers)
+        self.running = 0 # blocks being called right now
+        self.reset_stats()
+
+    def __repr__(self):
+        return "<BlockExecutor workers={} depth={}>".format(len(self.threads), self.depth())
+
+    def start(self):
+        """ Starts worker threads until there are `self.num_workers` running """
+        with self.lock:
+            self.threads = [thread for thread in self.threads if thread.is_alive()]
+            while len(self.threads) < self.num_workers:
+                thread = threading.Thread(target=self.work)
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+        return
+
+    def set_workers(self, n):
+        """ Changes the number of worker threads. Surplus workers finish their
+            current block before stopping """
+        n = int(n)
+        assert n > 0, "Number of workers must be at least 1"
+        with self.lock:
+            surplus = len(self.threads) - n
+            self.num_workers = n
+        for i in range(surplus):
+            self.tasks.put(None)
+        if surplus < 0:
+            self.start()
+        return
+
+    def submit(self, block, beat):
+        """ Adds a block to the end of the queue of work """
+        self.tasks.put((block, beat, self.timer()))
+        with self.lock:
+            self.submitted += 1
+            depth = self.tasks.qsize()
+            if depth > self.max_depth:
+                self.max_depth = depth
+        return
+
+    def work(self):
+        """ Worker thread loop: calls blocks until given `None` """
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+            block, beat, dispatched = task
+            wait = self.timer() - dispatched
+            with self.lock:
+                self.total_wait += wait
+                if wait > self.max_wait:
+                    self.max_wait = wait
+                self.running += 1
+                if self.running > self.max_running:
+                    self.max_running = self.running
+            try:
+                self.func(block, beat, dispatched)
+            except SystemExit:
+                break
+            except:
+                print(error_stack())
+            finally:
+                with self.lock:
+                    self.running   -= 1
+                    self.completed += 1
+        with self.lock:
+            if threading.current_thread() in self.threads:
+                self.threads.remove(threading.current_thread())
+        return
+
+    def depth(self):
+        """ Returns the number of blocks waiting for a worker """
+        return self.tasks.qsize()
+
+    def in_flight(self):
+        """ Returns the number of blocks waiting for, or being called by, a worker """
+        return self.tasks.qsize() + self.running
+
+    def stats(self):
+        """ Returns a dictionary of counters for the blocks handled so far """
+        with self.lock:
+            return {
+                "workers"   : len(self.threads),
+                "depth"     : self.tasks.qsize(),
+                "max_depth" : self.max_depth,
+                "running"   : self.running,
+                "max_running" : self.max_running,
+                "submitted" : self.submitted,
+                "completed" : self.completed,
+                "mean_wait" : (self.total_wait / self.completed) if self.completed else 0.0,
+                "max_wait"  : self.max_wait,
+            }
+
+    def reset_stats(self):
+        """ Sets the counters returned by `stats` back to zero """
+        with self.lock:
+            self.submitted  = 0
+            self.completed  = 0
+            self.max_depth  = 0
+            self.total_wait = 0.0
+            self.max_wait   = 0.0
+            self.max_running = self.running
+        return
+
+    def shutdown(self, timeout=1.0):
+        """ Discards any blocks not yet called and stops the worker threads """
+        try:
+            while True:
+                self.tasks.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            threads = list(self.threads)
+        for thread in threads:
+            self.tasks.put(None)
+        for thread in threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
+        return
+
+class LoopStats(object):
+    """ Records how accurately the clock thread wakes up for each queue block and
+        how much CPU time the clock thread uses, so that the polling and deadline
+        modes can be compared. CPU usage is measured against the real time that
+        has passed, whatever the clock's time source """
+
+    thread_time = staticmethod(getattr(time, "thread_time", None) or getattr(time, "process_time", None) or time.clock)
+    timer = staticmethod(getattr(time, "perf_counter", None) or time.time)
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """ Clears the counters. The clock thread starts measuring again on its next loop """
+        self.wakeups = 0
+        self.total_error = 0.0
+        self.max_error = 0.0
+        self.cpu_start  = None
+        self.wall_start = None
+        self.cpu  = 0.0
+        self.wall = 0.0
+        return
+
+    def add_wake_error(self, error):
+        """ Stores the time between a block's due time and when it was activated """
+        self.wakeups += 1
+        self.total_error += error
+        if abs(error) > abs(self.max_error):
+            self.max_error = error
+        return
+
+    def tick(self):
+        """ Called by the clock thread on each loop to measure its CPU usage """
+        cpu, wall = self.thread_time(), self.timer()
+        if self.cpu_start is None:
+            self.cpu_start, self.wall_start = cpu, wall
+        self.cpu  = cpu - self.cpu_start
+        self.wall = wall - self.wall_start
+        return
+
+    def stats(self):
+        """ Returns a dictionary of the wake-up error (seconds) and CPU usage (fraction of one core) """
+        return {
+            "wakeups"         : self.wakeups,
+            "mean_wake_error" : (self.total_error / self.wakeups) if self.wakeups else 0.0,
+            "max_wake_error"  : self.max_error,
+            "cpu_usage"       : (self.cpu / self.wall) if self.wall > 0 else 0.0,
+        }
+
+class BlockStats(object):
+    """ Records how late each queue block was called, how long it took to call its
+        items, how many items it had, and how many OSC bundles were dropped because
+        their timetag had already passed. Lateness is counted in bins of seconds:
+        the first bin includes blocks called early and the last any later than 0.25.
+        Lateness uses the clock's time source but durations are measured using `timer`
+        so that they are the real time taken, even with a `ManualTime` source """
+
+    lateness_bins = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+
+    timer = staticmethod(getattr(time, "perf_counter", None) or time.time)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ Clears the counters """
+        with self.lock:
+            self.blocks = 0
+            self.histogram = [0 for n in range(len(self.lateness_bins) + 1)]
+            self.total_lateness = 0.0
+            self.max_lateness = 0.0
+            self.total_duration = 0.0
+            self.max_duration = 0.0
+            self.total_items = 0
+            self.max_items = 0
+            self.dropped = 0
+            self.late = {}
+        return
+
+    def add_block(self, lateness, duration, items):
+        """ Stores the lateness and duration (seconds) and number of items of a block """
+        i = bisect.bisect_left(self.lateness_bins, lateness)
+        with self.lock:
+            self.blocks += 1
+            self.histogram[i] += 1
+            self.total_lateness += lateness
+            self.max_lateness = max(self.max_lateness, lateness)
+            self.total_duration += duration
+            self.max_duration = max(self.max_duration, duration)
+            self.total_items += items
+            self.max_items = max(self.max_items, items)
+        return
+
+    def add_dropped(self):
+        """ Counts an OSC bundle that was not sent because it was late """
+        with self.lock:
+            self.dropped += 1
+        return
+
+    def add_late(self, action):
+        """ Counts a late block dealt with by the clock's late policy """
+        with self.lock:
+            self.late[action] = self.late.get(action, 0) + 1
+        return
+
+    def stats(self):
+        """ Returns a dictionary of the counters """
+        with self.lock:
+            n = max(self.blocks, 1)
+            labels = ["<={}".format(value) for value in self.lateness_bins] + [">{}".format(self.lateness_bins[-1])]
+            return {
+                "blocks"           : self.blocks,
+                "lateness"         : OrderedDict(zip(labels, self.histogram)),
+                "mean_lateness"    : self.total_lateness / n,
+                "max_lateness"     : self.max_lateness,
+                "mean_duration"    : self.total_duration / n,
+                "max_duration"     : self.max_duration,
+                "mean_items"       : self.total_items / n,
+                "max_items"        : self.max_items,
+                "dropped_bundles"  : self.dropped,
+                "late_blocks"      : dict(self.late),
+            }
+
+class VoiceManager(object):
+    """ Used by a `TempoClock` to keep track of the notes that are playing on the server
+        and limit how many can play at once, in total and for each player. A note is
+        playing from its timetag until its sustain, plus `tail` seconds for the server to
+        detect it has gone silent, has passed. When a new note would go over a limit, the
+        `policy` is used:
+
+        - "steal": free the note that started first, for the player if its limit was
+          reached or for any player if the total was reached, when the new note starts
+          or, if the stolen note has a later timetag e.g. because of a `delay`, when the
+          stolen note starts
+        - "drop": don't send the new note
+
+        Each note is a group on the server, so a stolen note is freed using `/n_free`.
+        FoxDot's SynthDefs have fixed-length envelopes, without a gate, so `/n_set gate 0`
+        would not release them. If a note is cancelled because its event is built again,
+        the notes it stole are counted again. """
+
+    policies = ("steal", "drop")
+    tail = 0.1
+
+    def __init__(self, metro):
+        self.metro = metro
+        self.lock  = threading.Lock()
+        self.max_voices = None
+        self.max_player_voices = None
+        self.policy = "steal"
+        self.reset()
+
+    def reset(self):
+        """ Forgets the notes that are playing and clears the counters """
+        with self.lock:
+            self.ends    = [] # heap of (end, n, voice)
+            self.order   = [] # heap of (start, n, voice) for all players
+            self.players = {} # heap of (start, n, voice) for each player with notes playing
+            self.counts  = {}
+            self.total   = 0
+            self.n       = 0
+        self.reset_stats()
+        return
+
+    def reset_stats(self):
+        """ Clears the numbers of notes stolen and dropped """
+        with self.lock:
+            self.stolen  = 0
+            self.dropped = 0
+        return
+
+    def set_limit(self, total=None, player=None, policy="steal"):
+        """ Sets the most notes that can play at once in total and for each player.
+            Use `None` for no limit """
+        assert policy in self.policies, "Voice policy must be one of {}".format(self.policies)
+        assert total is None or total > 0, "Voice limit must be at least 1"
+        assert player is None or player > 0, "Voice limit must be at least 1"
+        self.max_voices = total
+        self.max_player_voices = player
+        self.policy = policy
+        return
+
+    def limited(self, player):
+        """ Returns True if notes for `player` need to be counted """
+        return self.max_voices is not None or self.max_player_voices is not None or player.max_voices is not None
+
+    def add(self, player, event_n, start, sus, node=None):
+        """ Counts a note from `player` that starts at `start` and lasts `sus` seconds,
+            and returns a list of the node and the time to free it for each note that
+            should be stopped to make room for it. Returns None if the note should not
+            be sent """
+
+        limit = player.max_voices if player.max_voices is not None else self.max_player_voices
+
+        steal = []
+
+        with self.lock:
+
+            self.expire(start)
+
+            voices = self.players.get(player, [])
+
+            while limit is not None and self.counts.get(player, 0) >= limit:
+
+                if self.policy == "drop" or self.counts.get(player, 0) == 0:
+
+                    self.dropped += 1
+
+                    return None
+
+                steal.append(self.steal(voices))
+
+            while self.max_voices is not None and self.total >= self.max_voices:
+
+                if self.policy == "drop":
+
+                    self.dropped += 1
+
+                    return None
+
+                steal.append(self.steal(self.order))
+
+            # [end, player, event number, node, is playing, start, notes it stole]
+
+            self.push([start + sus + self.tail, player, event_n, node, True, start, steal])
+
+            self.stolen += len(steal)
+
+        return [(voice[3], max(start, voice[5])) for voice in steal if voice[3] is not None]
+
+    def push(self, voice):
+        """ Counts a voice as playing and adds it to the heaps """
+        self.n += 1
+        heapq.heappush(self.ends, (voice[0], self.n, voice))
+        heapq.heappush(self.players.setdefault(voice[1], []), (voice[5], self.n, voice))
+        heapq.heappush(self.order, (voice[5], self.n, voice))
+        voice[4] = True
+        self.counts[voice[1]] = self.counts.get(voice[1], 0) + 1
+        self.total += 1
+        return
+
+    def expire(self, time):
+        """ Removes the notes that have finished by `time` """
+        while len(self.ends) > 0 and self.ends[0][0] <= time:
+            voice = heapq.heappop(self.ends)[2]
+            if voice[4]:
+                self.remove(voice)
+                voice[6] = []
+                if voice[1] in self.players:
+                    self.trim(self.players[voice[1]])
+                self.trim(self.order)
+        return
+
+    @staticmethod
+    def trim(voices):
+        """ Removes the voices that have stopped from the top of a heap """
+        while len(voices) > 0 and not voices[0][2][4]:
+            heapq.heappop(voices)
+        return
+
+    def oldest(self, voices):
+        """ Returns the voice in the heap `voices` that started first and is still playing """
+        self.trim(voices)
+        return voices[0][2]
+
+    def steal(self, voices):
+        """ Stops counting the voice in the heap `voices` that started first and returns
+            it. The notes it stole are forgotten so they can't be counted again """
+        voice = self.remove(self.oldest(voices))
+        voice[6] = []
+        return voice
+
+    def remove(self, voice):
+        """ Stops counting a voice and returns it. Players with no notes playing are
+            forgotten so that players that have been stopped are not kept """
+        voice[4] = False
+        self.counts[voice[1]] -= 1
+        self.total -= 1
+        if self.counts[voice[1]] == 0:
+            del self.counts[voice[1]]
+            del self.players[voice[1]]
+        return voice
+
+    def cancel(self, player, event_n):
+        """ Stops counting the notes from `player` with an event number of `event_n` or
+            more, which are built again when events made ahead of time are re-built, and
+            counts the notes they stole again """
+        with self.lock:
+            cancelled = []
+            for start, n, voice in list(self.players.get(player, ())):
+                if voice[4] and voice[2] >= event_n:
+                    cancelled.append(self.remove(voice))
+            for voice in cancelled:
+                for stolen in voice[6]:
+                    if not stolen[4] and not (stolen[1] is player and stolen[2] >= event_n):
+                        self.push(stolen)
+                        self.stolen -= 1
+                voice[6] = []
+        return
+
+    def active(self, player=None):
+        """ Returns the number of notes playing, or the number playing for `player` """
+        with self.lock:
+            self.expire(self.metro.get_machine_time())
+            return self.total if player is None else self.counts.get(player, 0)
+
+    def stats(self):
+        """ Returns a dictionary of the counters """
+        with self.lock:
+            return {
+                "active"  : self.total,
+                "players" : {str(player): count for player, count in self.counts.items() if count > 0},
+                "stolen"  : self.stolen,
+                "dropped" : self.dropped,
+            }
+
+class Profiler(object):
+    """ Stores how long each object called by the clock takes, in seconds, for the
+        last `bars` bars. Items are grouped by the object and its name e.g. a player's
+        name or the method called by an every() call. """
+
+    timer = staticmethod(getattr(time, "perf_counter", None) or time.time)
+
+    def __init__(self, metro, bars=4):
+        self.metro = metro
+        self.lock  = threading.Lock()
+        self.bars  = deque(maxlen=max(1, int(bars))) # (bar, {(id, name): [calls, total, max]})
+
+    def __repr__(self):
+        return self.report()
+
+    @staticmethod
+    def get_name(obj):
+        """ Returns a name to show in the report for `obj` """
+        if isinstance(obj, Player):
+            return repr(obj)
+        elif isinstance(obj, MethodCall):
+            return "{}.every({})".format(obj.parent, obj.method.__name__)
+        elif hasattr(obj, "__name__"):
+            return getattr(obj, "__qualname__", obj.__name__)
+        return type(obj).__name__
+
+    def add(self, obj, beat, duration):
+        """ Stores the time taken to call `obj` in the queue block at `beat` """
+        bar = int(beat // self.metro.bar_length())
+        key = (id(obj), self.get_name(obj))
+        with self.lock:
+            if len(self.bars) == 0 or self.bars[-1][0] != bar:
+                self.bars.append((bar, {}))
+            data = self.bars[-1][1]
+            if key not in data:
+                data[key] = [0, 0.0, 0.0]
+            entry = data[key]
+            entry[0] += 1
+            entry[1] += duration
+            entry[2] = max(entry[2], duration)
+        return
+
+    def top(self, n=10, bars=None):
+        """ Returns a list of (name, calls, total, max) for the `n` items with the largest
+            total time over the last `bars` bars, or all the bars stored """
+        totals = {}
+        with self.lock:
+            data = list(self.bars)[-bars:] if bars else list(self.bars)
+            for bar, items in data:
+                for key, (calls, total, longest) in items.items():
+                    entry = totals.setdefault(key, [0, 0.0, 0.0])
+                    entry[0] += calls
+                    entry[1] += total
+                    entry[2] = max(entry[2], longest)
+        items = sorted(totals.items(), key=lambda x: x[1][1], reverse=True)[:n]
+        return [(name, calls, total, longest) for (ident, name), (calls, total, longest) in items]
+
+    def report(self, n=10, bars=None):
+        """ Returns the `n` items with the largest total time as a table """
+        lines = ["{:<40} {:>8} {:>10} {:>10} {:>10}".format("item", "calls", "total ms", "mean ms", "max ms")]
+        for name, calls, total, longest in self.top(n, bars):
+            lines.append("{:<40} {:>8} {:>10.3f} {:>10.3f} {:>10.3f}".format(name[:40], calls, 1000 * total, 1000 * total / calls, 1000 * longest))
+        return "\n".join(lines)
+
+class BundlePacker(object):
+    """ Used by a `TempoClock` to send the OSC bundles for notes that are due at the same
+        time in as few datagrams of up to `size` bytes as possible. Bundles with the same
+        timetag are merged, and the merged bundles are nested in one bundle per datagram
+        with the earliest timetag. Bundles for MIDI messages are left as they are """
+    def __init__(self, size=1472):
+        assert size > 16, "Bundle size must be more than 16 bytes"
+        self.size = size
+
+    def pack(self, bundles):
+        """ Returns a list of OSC bundles that contain the notes in `bundles` packed into as
+            few datagrams of up to `size` bytes as possible """
+        packed = []
+        groups = [] # (timetag, bundles) in the datagram being packed
+        size   = 16 # a bundle's header and timetag
+        for bundle in sorted(bundles, key=lambda bundle: bundle.timetag):
+            if bundle.address == OSC_MIDI_ADDRESS:
+                packed.append(bundle)
+                continue
+            # A new timetag needs a nested bundle, which is stored as a blob with its length
+            same = len(groups) > 0 and groups[-1][0] == bundle.timetag
+            extra = len(bundle.message) if same else 20 + len(bundle.message)
+            if len(groups) > 0 and size + extra > self.size:
+                packed.append(self.merge(groups))
+                groups, size = [], 16
+                same, extra = False, 20 + len(bundle.message)
+            if same:
+                groups[-1][1].append(bundle)
+            else:
+                groups.append((bundle.timetag, [bundle]))
+            size += extra
+        if len(groups) > 0:
+            packed.append(self.merge(groups))
+        return packed
+
+    @staticmethod
+    def merge(groups):
+        """ Returns one OSC bundle that contains the bundles in each (timetag, bundles) group """
+        merged = []
+        for timetag, bundles in groups:
+            if len(bundles) == 1:
+                merged.append(bundles[0])
+            else:
+                bundle = OSCBundle(time=timetag)
+                bundle.message  = b"".join(item.message for item in bundles)
+                bundle.typetags = "," + "".join(item.typetags[1:] for item in bundles)
+                merged.append(bundle)
+        if len(merged) == 1:
+            return merged[0]
+        bundle = OSCBundle(time=groups[0][0])
+        for item in merged:
+            bundle.append(item)
+        return bundle
+
+class BundleSender(object):
+    """ Used in lookahead mode to hold OSC bundles that have been built ahead of
+        time. A single thread sends each bundle `latency` seconds before its
+        timetag. Bundles built by a player's event store the player, event
+        number, and beat so that they can be cancelled and re-built if the
+        player is updated before they are sent. """
+    def __init__(self, metro):
+        self.metro  = metro
+        self.heap   = []
+        self.wake   = threading.Condition()
+        self.thread = None
+        self.running = False
+        self.counter = 0 # keeps bundles with the same send time in order
+        self.generation = 0 # the sending loop stops if it has been started again
+        self.sent = 0
+        self.cancelled = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def start(self):
+        """ Starts the sending thread if it is not already running. A thread that has
+            been told to stop but hasn't finished yet is replaced """
+        with self.wake:
+            if self.running and self.thread is not None and self.thread.is_alive():
+                return
+            self.running = True
+            self.generation += 1
+            self.thread = threading.Thread(target=self.run, args=(self.generation,))
+            self.thread.daemon = True
+            self.thread.start()
+            self.wake.notify_all()
+        return
+
+    def stop(self):
+        """ Discards any bundles not yet sent and stops the sending thread """
+        with self.wake:
+            self.running = False
+            del self.heap[:]
+            self.wake.notify_all()
+        return
+
+    def add(self, bundle, source=None):
+        """ Stores a bundle to be sent `latency` seconds before its timetag """
+        send_time = bundle.timetag - self.metro.latency
+        with self.wake:
+            self.counter += 1
+            heapq.heappush(self.heap, (send_time, self.counter, bundle, source))
+            if self.heap[0][2] is bundle:
+                self.wake.notify_all()
+        return
+
+    def cancel(self, player):
+        """ Removes the bundles built by `player` that have not been sent. Returns the event
+            number and beat of the earliest one cancelled, or None if there weren't any """
+        earliest = None
+        with self.wake:
+            keep = []
+            for entry in self.heap:
+                source = entry[3]
+                if source is not None and source[0] is player:
+                    if earliest is None or source[2] < earliest[1]:
+                        earliest = (source[1], source[2])
+                    self.cancelled += 1
+                else:
+                    keep.append(entry)
+            heapq.heapify(keep)
+            self.heap = keep
+        return earliest
+
+    def clear(self):
+        """ Discards any bundles not yet sent """
+        with self.wake:
+            del self.heap[:]
+        return
+
+    def run(self, generation=0):
+        """ Sends each bundle when it is due """
+        while True:
+            with self.wake:
+                if not self.running or self.generation != generation:
+                    break
+                if len(self.heap) == 0:
+                    self.wake.wait()
+                    continue
+                now = self.metro.get_machine_time()
+                remaining = self.heap[0][0] - now
+                if remaining > 0:
+                    self.wake.wait(remaining)
+                    continue
+                bundles = self.pop_due(now)
+            self.send(bundles)
+        return
+
+    def pop_due(self, now):
+        """ Removes and returns the bundles that should be sent by `now` """
+        bundles = []
+        while len(self.heap) > 0 and self.heap[0][0] <= now:
+            bundles.append(heapq.heappop(self.heap)[2])
+        return bundles
+
+    def send(self, bundles):
+        """ Sends bundles to the server, packed into datagrams if the clock has a bundle size """
+        self.sent += len(bundles)
+        if self.metro.packer is not None:
+            bundles = self.metro.packer.pack(bundles)
+        for bundle in bundles:
+            try:
+                self.metro.server.sendOSC(bundle)
+            except:
+                print(error_stack())
+        return
+
+class TimeSource(object):
+    """ Base class for the source of machine time used by a `TempoClock`. Times
+        are in seconds since the epoch so that they can be used for OSC timetags """
+    manual = False
+    def __call__(self):
+        return self.time()
+    def time(self):
+        raise NotImplementedError
+
+class WallTime(TimeSource):
+    """ The system clock i.e. `time.time()`. Used by default """
+    def time(self):
+        return time.time()
+
+class MonotonicTime(TimeSource):
+    """ A clock that cannot go backwards if the system clock is changed,
+        offset so that it starts at the current system time """
+    def __init__(self):
+        self.clock  = getattr(time, "monotonic", time.time)
+        self.offset = time.time() - self.clock()
+    def time(self):
+        return self.clock() + self.offset
+
+class ManualTime(TimeSource):
+    """ A clock that only moves forward when told to using `step` or `set`. A
+        `TempoClock` using this does not run its own thread and is moved on
+        using `TempoClock.step` instead """
+    manual = True
+    def __init__(self, start=None):
+        self.now = time.time() if start is None else float(start)
+    def time(self):
+        return self.now
+    def set(self, value):
+        self.now = float(value)
+    def step(self, seconds):
+        self.now += seconds
+
 class History(object):
     """
     Stores osc messages send from the TempoClock so that if the
-    Clock is reveresed we can just send the osc messages already sent
+    Clock is reveresed we can just send the osc messages already sent.
 
+    Each bundle is stored as its encoded contents, address, and timetag
+    relative to its queue block. The oldest beats are removed once more
+    than `max_beats` beats or `max_bytes` bytes are stored. Setting
+    `max_beats` to 0 turns the history off. In lookahead mode bundles are
+    sent by the `BundleSender` and are not stored.
     """
-    def __init__(self):
-        self.data = []
-    def add(self, beat, osc_messages):
-        self.data.append(osc_messages)
+    def __init__(self, max_beats=64, max_bytes=4194304):
+        self.max_beats = max_beats
+        self.max_bytes = max_bytes
+        self.data = OrderedDict() # beat -> (time, bundles, size)
+        self.size = 0
+        self.first_beat = None    # beats after this have all been stored...
+        self.removed_beat = None  # ...and this is the most recent beat removed
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, beat):
+        return beat in self.data
+
+    def add(self, beat, time, osc_messages):
+        """ Stores the OSC bundles sent by the queue block at `beat`, called at `time` """
+        if self.max_beats <= 0:
+            return
+        bundles = [(msg.timetag - time, msg.address, msg.message) for msg in osc_messages]
+        size = sum([len(bundle[2]) for bundle in bundles])
+        with self.lock:
+            if beat in self.data:
+                self.size -= self.data.pop(beat)[2]
+            if self.first_beat is None:
+                self.first_beat = beat
+            self.data[beat] = (time, bundles, size)
+            self.size += size
+            # Remove the oldest beats
+            while len(self.data) > 1:
+                oldest = next(iter(self.data))
+                if beat - oldest <= self.max_beats and self.size <= self.max_bytes:
+                    break
+                self.size -= self.data.pop(oldest)[2]
+                self.removed_beat = oldest if self.removed_beat is None else max(oldest, self.removed_beat)
+        return
+
+    def covers(self, beat):
+        """ Returns True if everything sent from `beat` onwards has been stored """
+        if self.first_beat is None or beat < self.first_beat:
+            return False
+        return self.removed_beat is None or beat > self.removed_beat
+
+    def beats(self, start, end):
+        """ Returns the beats stored between `start` and `end`, in order """
+        with self.lock:
+            return sorted([beat for beat in self.data if start <= beat < end])
+
+    def get_bundles(self, beat, time):
+        """ Returns new OSC bundles stored for `beat` with timetags relative to `time` """
+        with self.lock:
+            entry = self.data.get(beat)
+        bundles = []
+        if entry is not None:
+            for offset, address, message in entry[1]:
+                bundle = OSCBundle(address, time=time + offset)
+                bundle.message = message
+                bundles.append(bundle)
+        return bundles
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.size = 0
+            self.first_beat = self.removed_beat = None
+        return
+
+    def export(self, filename):
+        """ Writes the history to a JSON file for analysing timing problems. Each
+            entry has the beat, the time it was called, and the timetag, address
+            and encoded contents (in hex) of each bundle """
+        with self.lock:
+            entries = list(self.data.items())
+        data = [{
+            "beat"    : float(beat),
+            "time"    : time,
+            "bundles" : [{
+                "timetag" : time + offset,
+                "address" : address,
+                "data"    : binascii.hexlify(message).decode()
+            } for offset, address, message in bundles]
+        } for beat, (time, bundles, size) in entries]
+        with open(filename, "w") as f:
+            json.dump(data, f, indent=1)
+        return
 
 from . import Code
 
@@ -24,6 +24,18 @@ def fetch(func):
         return func(a, b)
     return eval_now
 
+def preview_copy(method):
+    """ Decorator for TimeVar methods that move its values on with time. While the
+        clock is previewing events the method is called on a copy of the TimeVar
+        so that it isn't changed by the preview """
+    def wrapper(self, *args, **kwargs):
+        if self.metro.is_previewing():
+            self = self.metro.get_preview_copy(self)
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__  = method.__doc__
+    return wrapper
+
 
 class TimeVar(object):
     """ Var(values [,durs=[4]]) """
@@ -143,6 +155,7 @@ class TimeVar(object):
 
         return self
 
+    @preview_copy
     def get_current_index(self, time=None):
         """ Returns the index of the value currently represented """
 
@@ -231,6 +244,7 @@ class TimeVar(object):
             beat *= (self.bpm / float(self.metro.bpm))
         return float(beat)
 
+    @preview_copy
     def now(self, time=None):
         """ Returns the value currently represented by this TimeVar """
 
@@ -483,11 +497,13 @@ class ChildTimeVar(TimeVar):
         e.g. var([0,2]) + 2, then a ChildTimeVar is created that contains a
         single value but also creates a new ChildTimeVar when operated upon
         and behaves just as a TimeVar does."""
+    @preview_copy
     def now(self, time=None):
         self.current_value = self.calculate(self.values[0])
         return self.current_value
 
 class linvar(TimeVar):
+    @preview_copy
     def now(self, time=None):
         """ Returns the value currently represented by this TimeVar """
         i = self.get_current_index(time)
@@ -718,6 +734,7 @@ class Pvar(TimeVar):
         return new
 
 class ChildPvar(Pvar):
+    @preview_copy
     def now(self, time=None):
         self.current_value = self.calculate(self.values[0])
         return self.current_value
@@ -747,6 +764,7 @@ class PvarGenerator(Pvar):
     def info(self):
         return "<{} {}>".format(self.__class__.__name__, self.func.__name__ + str(tuple(self.args)))
 
+    @preview_copy
     def now(self):
         new_args = [arg.now() if isinstance(arg, TimeVar) else arg for arg in self.args]
         if new_args != self.last_args:
@@ -821,10 +839,12 @@ class mapvar(Pvar):
         self.values  = {key: asStream(value) for key, value in mapping.items()}
         self.default = asStream(default)
 
+    @preview_copy
     def get_current_index(self, time=None):
         self.current_index = self.key.now()
         return self.current_index
 
+    @preview_copy
     def now(self, time=None):
         """ Returns the value currently represented by this TimeVar """
         i = self.get_current_index(time)
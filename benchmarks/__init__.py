@@ -0,0 +1,7 @@
+"""
+    Benchmarks for FoxDot's scheduling and event pipeline. Each module can be run
+    from the root of the repository, e.g.
+
+        python -m benchmarks.bench_queue
+
+"""
@@ -0,0 +1,82 @@
+"""
+    Benchmarks `Player.send`, which expands the PGroups in a player's event into
+    one OSC message per note, for a few chord-heavy players. The server's
+    `get_bundle` is replaced so that the results don't include OSC encoding,
+    and the messages are counted by a block that stands in for a queue block.
+
+        python -m benchmarks.bench_chords [num_events]
+
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import sys
+import time
+
+from FoxDot.lib import Clock, Player, ManualTime, P, pluck, pads, play
+
+class PacketServer(object):
+    """ Wraps the clock's server and returns the packet instead of an OSC bundle """
+    def __init__(self, server):
+        self.server = server
+    def __getattr__(self, attr):
+        return getattr(self.server, attr)
+    def get_bundle(self, synthdef, packet, timestamp=0, group_id=None):
+        return packet
+
+class CountingBlock(object):
+    """ Stands in for a `QueueBlock` and counts the OSC messages added to it """
+    def __init__(self):
+        self.time  = 0
+        self.count = 0
+    def append_osc_message(self, message):
+        self.count += 1
+
+def players():
+    """ Returns a list of (description, player) for each benchmark """
+
+    triads = Player("bench_triads")
+    triads >> pluck([(0, 2, 4), (1, 3, 5)], dur=1/2)
+
+    spread = Player("bench_spread")
+    spread >> pads(P[0, 3] + (0, 2, 4, 6), pan=(-1, 0, 1), lpf=(500, 2000))
+
+    nested = Player("bench_nested")
+    nested >> pluck([(0, (2, 4)), (0, 2, (4, 6))], pan=(-1, (0, 1)), amp=[1, (1, 1/2)], delay=(0, 1/4))
+
+    drums = Player("bench_drums")
+    drums >> play("(x[--])(o*)", sample=(0, 1, 2))
+
+    return [("triads", triads), ("spread", spread), ("nested", nested), ("drums", drums)]
+
+def main(num_events=2000):
+
+    Clock.set_time_source(ManualTime())
+
+    Clock.server = PacketServer(Clock.server)
+
+    for name, player in players():
+
+        block = CountingBlock()
+
+        player.set_queue_block(block)
+
+        start = time.time()
+
+        for n in range(num_events):
+
+            player.get_event()
+
+            player.send()
+
+            player.event_n += 1
+
+        elapsed = time.time() - start
+
+        print("{:<8} {:.2f}us per event, {:.2f}us per message".format(name, 1e6 * elapsed / num_events, 1e6 * elapsed / max(block.count, 1)))
+
+    return
+
+if __name__ == "__main__":
+
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,65 @@
+"""
+    Benchmarks calling `Player` objects in the `TempoClock`. The clock uses a
+    `ManualTime` time source so it is moved on by `Clock.step` without sleeping
+    and the results show only the time spent processing events.
+
+        python -m benchmarks.bench_clock [num_players] [num_beats]
+
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import sys
+import time
+
+from FoxDot.lib import Clock, Player, ManualTime, pluck, play
+
+class CountingServer(object):
+    """ Wraps the clock's server and counts the OSC bundles instead of sending them """
+    def __init__(self, server):
+        self.server = server
+        self.count  = 0
+    def __getattr__(self, attr):
+        return getattr(self.server, attr)
+    def sendOSC(self, osc_message):
+        self.count += 1
+
+def main(num_players=16, num_beats=64):
+
+    Clock.set_time_source(ManualTime())
+
+    server = Clock.server = CountingServer(Clock.server)
+
+    players = [Player("bench_{}".format(n)) for n in range(num_players)]
+
+    for n, player in enumerate(players):
+
+        if n % 2:
+
+            player >> pluck([0, 2, 4, (0, 4)], dur=[1/2, 1/4, 1/4], sus=1)
+
+        else:
+
+            player >> play("x-o-", sample=[0, 1])
+
+    # Let the players start on the next bar
+
+    Clock.step(Clock.next_bar() - Clock.now())
+
+    start = time.time()
+
+    num_blocks = Clock.step(num_beats)
+
+    elapsed = time.time() - start
+
+    num_events = sum(player.event_n for player in players)
+
+    print("{} players for {} beats: {} blocks, {} events, {} bundles".format(num_players, num_beats, num_blocks, num_events, server.count))
+    print("total:  {:.3f}s ({:.0f} events/s)".format(elapsed, num_events / elapsed))
+    print("event:  {:.2f}us per event".format(1e6 * elapsed / max(num_events, 1)))
+
+    return
+
+if __name__ == "__main__":
+
+    main(*[int(arg) for arg in sys.argv[1:3]])
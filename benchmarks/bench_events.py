@@ -0,0 +1,52 @@
+"""
+    Benchmarks `Player.get_event`, which calculates the values of all of a player's
+    attributes for its next event, for a few typical players.
+
+        python -m benchmarks.bench_events [num_events]
+
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import sys
+import time
+
+from FoxDot.lib import Clock, Player, ManualTime, pluck, play, pads, var, linvar
+
+def players():
+    """ Returns a list of (description, player) for each benchmark """
+
+    simple = Player("bench_simple")
+    simple >> pluck([0, 2, 4, 7], dur=1/2)
+
+    drums = Player("bench_drums")
+    drums >> play("x-o[--]", sample=[0, 1], amp=[1, 0.5])
+
+    timevar = Player("bench_timevar")
+    timevar >> pads((0, 2, 4), dur=[1, 1/2], pan=linvar([-1, 1], 8), lpf=var([500, 2000], 4))
+
+    return [("simple", simple), ("drums", drums), ("timevar", timevar)]
+
+def main(num_events=10000):
+
+    Clock.set_time_source(ManualTime())
+
+    for name, player in players():
+
+        start = time.time()
+
+        for n in range(num_events):
+
+            player.get_event()
+
+            player.event_n += 1
+
+        elapsed = time.time() - start
+
+        print("{:<8} {:.2f}us per event".format(name, 1e6 * elapsed / num_events))
+
+    return
+
+if __name__ == "__main__":
+
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,61 @@
+"""
+    Benchmarks adding and removing events from the `TempoClock` queue.
+
+        python -m benchmarks.bench_queue [num_events]
+
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import sys
+import time
+import random
+
+from FoxDot.lib.TempoClock import Queue
+
+class DummyClock(object):
+    """ Stands in for a `TempoClock` so the queue can be used without a server """
+    server = None
+
+def event():
+    return
+
+def bench_schedule(queue, beats):
+    """ Schedules `event` at every beat value and returns the time taken """
+    start = time.time()
+    for beat in beats:
+        queue.add(event, beat)
+    return time.time() - start
+
+def bench_pop(queue):
+    """ Pops every block from the queue in order and returns the time taken """
+    start = time.time()
+    while len(queue):
+        queue.pop()
+    return time.time() - start
+
+def main(num_events=100000):
+
+    random.seed(0)
+
+    # Mix of distinct beats and beats that collide with existing blocks
+
+    beats = [random.randint(0, num_events // 4) * 0.25 for n in range(num_events)]
+
+    queue = Queue(DummyClock())
+
+    t_add = bench_schedule(queue, beats)
+
+    num_blocks = len(queue)
+
+    t_pop = bench_pop(queue)
+
+    print("Scheduled {} events into {} blocks".format(num_events, num_blocks))
+    print("schedule: {:.3f}s ({:.2f}us per event)".format(t_add, 1e6 * t_add / num_events))
+    print("pop:      {:.3f}s ({:.2f}us per block)".format(t_pop, 1e6 * t_pop / max(num_blocks, 1)))
+
+    return
+
+if __name__ == "__main__":
+
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,66 @@
+""" Tests for PlayerKeys and the keys derived from them """
+import unittest
+
+from FoxDot.lib.Key import NumberKey, PlayerKey
+
+
+class Counter(object):
+    """ Value that changes each time it is used, like a TimeVar """
+    def __init__(self):
+        self.value = 0
+    def now(self):
+        self.value += 1
+        return self.value
+
+
+class TestKeyStamp(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = 0
+        self.root  = PlayerKey(1, attr="degree")
+
+    def double(self, value):
+        self.calls += 1
+        return value * 2
+
+    def test_cached_until_root_changes(self):
+        """ A derived key is only calculated again when the value of its root key changes """
+        key = self.root.transform(self.double) + 1
+        self.assertEqual([key.now(), key.now()], [3, 3])
+        self.assertEqual(self.calls, 1)
+        self.root.update(1, 1)
+        self.assertEqual(key.now(), 3)
+        self.assertEqual(self.calls, 1)
+        self.root.update(4, 2)
+        self.assertEqual(key.now(), 9)
+        self.root.set(2, 3)
+        self.assertEqual(key.now(), 5)
+        self.assertEqual(self.calls, 3)
+
+    def test_other_key_changes(self):
+        """ A key combined with another key is calculated again when either changes """
+        other = PlayerKey(10, attr="degree")
+        key = self.root > other
+        self.assertEqual(key.now(), 0)
+        other.update(0, 1)
+        self.assertEqual(key.now(), 1)
+        key = (self.root + 1) * (other + 2)
+        self.assertEqual(key.now(), 4)
+        other.update(3, 2)
+        self.assertEqual(key.now(), 10)
+        self.root.update(2, 3)
+        self.assertEqual(key.now(), 15)
+
+    def test_time_varying_operand(self):
+        """ Keys combined with a value that changes over time are not cached """
+        key = self.root + NumberKey(Counter())
+        self.assertEqual([key.now(), key.now()], [2, 3])
+
+    def test_time_varying_root(self):
+        """ Keys derived from a value that changes over time are not cached """
+        key = NumberKey(Counter()) + 10
+        self.assertEqual([key.now(), key.now()], [11, 12])
+
+
+if __name__ == "__main__":
+    unittest.main()
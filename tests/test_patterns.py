@@ -1,10 +1,30 @@
 import unittest
 
 from FoxDot.lib import Patterns
+from FoxDot.lib.Patterns import P
 
 class TestPatternMethods(unittest.TestCase):
     pass
 
+class TestPatternVersion(unittest.TestCase):
+    def test_changed_in_place(self):
+        pattern = P[1, 2, 3]
+        versions = [pattern.version]
+        pattern[0] = 4
+        versions.append(pattern.version)
+        pattern.i_rotate()
+        versions.append(pattern.version)
+        pattern.append(5)
+        versions.append(pattern.version)
+        self.assertEqual(versions, [0, 1, 2, 3])
+        self.assertEqual(list(pattern), [2, 3, 4, 5])
+
+    def test_new_pattern(self):
+        pattern = P[1, 2, 3]
+        pattern.i_reverse()
+        self.assertEqual(pattern.rotate().version, 0)
+        self.assertEqual(pattern.version, 1)
+
 if __name__ == "__main__":
 
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,423 @@
+""" Tests for Players """
+import itertools
+import struct
+import threading
+import unittest
+
+from FoxDot.lib.Key import PlayerKey
+from FoxDot.lib.TempoClock import VoiceManager
+from FoxDot.lib import Clock, Player, P, pluck, var
+
+from tests.test_tempo_clock import PlayerClockTestCase
+
+
+def read_osc(data):
+    """ Returns a list of the address and arguments of each message in binary OSC data,
+        including those in nested bundles """
+    def read_string(data):
+        end = data.index(b"\0")
+        return data[:end].decode(), data[(end // 4 + 1) * 4:]
+    if data.startswith(b"#bundle"):
+        messages, data = [], data[16:]
+        while data:
+            size = struct.unpack(">i", data[:4])[0]
+            messages.extend(read_osc(data[4:4 + size]))
+            data = data[4 + size:]
+        return messages
+    address, data = read_string(data)
+    tags, data = read_string(data)
+    args = []
+    for tag in tags[1:]:
+        if tag == "s":
+            value, data = read_string(data)
+        else:
+            value, data = struct.unpack(">" + tag, data[:4])[0], data[4:]
+        args.append(value)
+    return [(address, args)]
+
+
+def read_notes(bundles, synthdef):
+    """ Returns a dictionary of the arguments of each `synthdef` node started by `bundles` """
+    notes = []
+    for bundle in bundles:
+        for address, args in read_osc(bundle.getBinary()):
+            if address == "/s_new" and args[0] == synthdef:
+                notes.append(dict(zip(args[4::2], args[5::2])))
+    return notes
+
+
+
+class TestEventTable(PlayerClockTestCase):
+
+    def setUp(self):
+        PlayerClockTestCase.setUp(self)
+        self.player = Player("test_table")
+        self.player >> pluck([0, 2, 4, 5], amp=0.5, pan=[-1, 1], lpf=var([500, 1000], 4))
+
+    def test_compiled(self):
+        """ Single values are stored in the template and everything else is calculated
+            for each event """
+        version, template, dynamic, prime_keys, versions = self.player.compile_event_table()
+        self.assertEqual(template["amp"], 0.5)
+        self.assertNotIn("amp", dynamic)
+        self.assertTrue(set(["degree", "pan", "lpf"]) <= set(dynamic))
+        events = [self.player.build_event(x) for x in range(4)]
+        self.assertEqual([event["degree"] for event in events], [0, 2, 4, 5])
+        self.assertEqual([event["pan"] for event in events], [-1, 1, -1, 1])
+        self.assertEqual(events[0]["lpf"], 500)
+
+    def test_recompiled_when_changed(self):
+        """ The table is compiled again after an attribute is set """
+        self.player.build_event()
+        self.player.amp = [1, 0.25]
+        self.assertNotEqual(self.player.event_table[0], self.player.attr.version)
+        self.assertEqual(self.player.build_event(1)["amp"], 0.25)
+        self.assertEqual(self.player.event_table[0], self.player.attr.version)
+        self.assertIn("amp", self.player.event_table[2])
+
+    def test_recompiled_when_changed_in_place(self):
+        """ The table is compiled again after a single value pattern is changed in place """
+        amp = P[0.5]
+        self.player.amp = amp
+        self.assertEqual(self.player.build_event()["amp"], 0.5)
+        amp[0] = 0.2
+        self.assertEqual(self.player.build_event()["amp"], 0.2)
+        amp.append(0.9)
+        self.assertEqual([self.player.build_event(x)["amp"] for x in range(2)], [0.2, 0.9])
+
+
+class TestPlayerKeys(PlayerClockTestCase):
+
+    def setUp(self):
+        PlayerClockTestCase.setUp(self)
+        self.player = Player("test_keys")
+        self.player >> pluck([0, 2, 4, 5])
+
+    def test_attribute_access(self):
+        """ Attributes are read as PlayerKeys that are kept out of the instance dict, and
+            internal variables are not treated as attributes """
+        key = self.player.degree
+        self.assertIsInstance(key, PlayerKey)
+        self.assertIs(self.player.pitch, key)
+        self.assertNotIn("degree", self.player.__dict__)
+        self.assertEqual(self.player.accessed_keys, ["degree"])
+        self.player.max_voices = 2
+        self.assertEqual(self.player.__dict__["max_voices"], 2)
+        self.assertNotIn("max_voices", self.player.attr)
+        with self.assertRaises(AttributeError):
+            self.player.not_an_attribute
+
+    def test_follows_player(self):
+        """ A key that has been read is updated each time the player plays """
+        key = self.player.degree
+        self.start(self.player)
+        values = []
+        for n in range(4):
+            values.append(key.now())
+            Clock.step(1)
+        self.assertEqual(values, [0, 2, 4, 5])
+
+
+class TestExpandEvent(PlayerClockTestCase):
+
+    def test_nested(self):
+        """ PGroups are indexed together and nested PGroups are expanded in place """
+        player = Player("test_expand")
+        event  = {"degree": P(0, P(2, P(4, 5)), P(7, 9)), "pan": P(-1, 1), "amp": 1}
+        packets = list(player.expand_event(event, ["degree", "pan"]))
+        self.assertEqual([(packet["degree"], packet["pan"]) for packet in packets],
+                         [(0, -1), (2, 1), (4, 1), (5, 1), (7, -1), (9, -1)])
+        self.assertTrue(all(packet["amp"] == 1 for packet in packets))
+        self.assertEqual(event["pan"], P(-1, 1))
+
+    def test_sent(self):
+        """ Each note in a chord is sent as its own node """
+        player = Player("test_chord")
+        player >> pluck((0, (2, 4)), pan=(-1, 1), amplify=0.5)
+        self.start(player)
+        notes = read_notes(self.sent, "pluck")
+        self.assertEqual([(note["midinote"], note["pan"]) for note in notes], [(60, -1), (64, 1), (67, 1)])
+        self.assertEqual([note["amp"] for note in notes], [0.5] * 3)
+
+
+class TestDefaultAttributes(PlayerClockTestCase):
+
+    def setUp(self):
+        PlayerClockTestCase.setUp(self)
+        self.p1, self.p2 = Player("test_defaults_1"), Player("test_defaults_2")
+        self.p1 >> pluck()
+        self.p2 >> pluck()
+
+    def test_shared(self):
+        """ Players with the same SynthDef share the patterns of attributes they haven't set """
+        self.assertIs(self.p1.attr["amp"], self.p2.attr["amp"])
+        self.assertNotIn("amp", self.p1.attr.changed())
+
+    def test_copied_when_changed_in_place(self):
+        """ Changing a default pattern in place only changes it for that player """
+        self.p1.build_event()
+        self.p1["amp"][0] = 0.5
+        self.assertEqual(self.p1.build_event()["amp"], 0.5)
+        self.assertEqual(self.p2.build_event()["amp"], 1)
+        attr, pan_set = self.p1.get_method_by_name("pan.set")
+        pan_set(0, 1)
+        self.assertEqual(list(self.p1.attr["pan"]), [1])
+        self.assertEqual(list(self.p2.attr["pan"]), [0])
+
+
+class TestRhythm(PlayerClockTestCase):
+
+    def setUp(self):
+        PlayerClockTestCase.setUp(self)
+        self.player = Player("test_rhythm")
+        self.player >> pluck(dur=[1, 0.5, 0.5, 2])
+
+    def test_count(self):
+        """ Returns the event playing at a beat, or the next event after it """
+        self.assertEqual(self.player.count(5.25), (5, 5.0))
+        self.assertEqual(self.player.count(5.25, event_after=True), (6, 5.5))
+        self.assertEqual(self.player.count(6), (7, 6))
+        self.assertEqual(self.player.count(400.5), (400, 400.0))
+
+    def test_table_kept_until_rhythm_changes(self):
+        """ The running totals are only worked out again when the durations change """
+        self.player.dur_updated()
+        rhythm = self.player.current_dur
+        self.player.count(5)
+        table = self.player.count_table
+        self.assertFalse(self.player.dur_updated())
+        self.player.count(9)
+        self.assertIs(self.player.count_table, table)
+        self.player.dur = [var([1, 1], 4), 0.5, 0.5, 2]
+        self.assertFalse(self.player.dur_updated())
+        self.assertIs(self.player.current_dur, rhythm)
+        self.player.count(9)
+        self.assertIs(self.player.count_table, table)
+        self.player.dur = [2, 2]
+        self.assertTrue(self.player.dur_updated())
+        self.assertEqual(self.player.count(9), (4, 8.0))
+        self.assertIsNot(self.player.count_table, table)
+
+    def test_nested_pattern_changed(self):
+        """ Changing a pattern nested in the dur in place changes the rhythm """
+        self.player.dur = [1, [0.5, 0.25]]
+        self.assertTrue(self.player.dur_updated())
+        self.assertEqual(self.player.current_dur, [1, 0.5, 1, 0.25])
+        self.assertFalse(self.player.dur_updated())
+        self.player.attr["dur"].data[1].i_reverse()
+        self.assertTrue(self.player.dur_updated())
+        self.assertEqual(self.player.current_dur, [1, 0.25, 1, 0.5])
+
+
+class TestPreview(PlayerClockTestCase):
+
+    def setUp(self):
+        PlayerClockTestCase.setUp(self)
+        self.player = Player("test_preview")
+        self.amp = var([1, 0.5], 2)
+        self.player >> pluck([0, (2, 4), 5], dur=[1, 0.5, 0.5], amp=self.amp, pan=[-1, 1])
+        self.start(self.player)
+
+    def state(self):
+        player = self.player
+        return (player.event_n, player.event_index, player.degree.now(), player.amp.now(), float(self.amp), Clock.now())
+
+    def test_state_unchanged(self):
+        """ Previewing doesn't change the player, its keys, or the clock """
+        before = self.state()
+        self.player.events(8)
+        self.player.render(6)
+        self.assertEqual(self.state(), before)
+        self.assertFalse(Clock.is_previewing())
+
+    def test_shared_timevar(self):
+        """ A preview doesn't change a TimeVar, even when the clock uses it at the same time """
+        events, before = self.player.iter_events(), dict(self.amp.__dict__)
+        for event in itertools.islice(events, 5):
+            pass
+        self.assertEqual(self.amp.__dict__, before)
+        thread = threading.Thread(target=Clock.step, args=(2.5,))
+        thread.start()
+        thread.join()
+        updated = dict(self.amp.__dict__)
+        self.assertNotEqual(updated, before)
+        events.close()
+        self.assertEqual(self.amp.__dict__, updated)
+        self.assertEqual(float(self.amp), 0.5)
+
+    def test_matches_sent(self):
+        """ The notes previewed are the notes that are sent when the clock reaches them """
+        start = Clock.now()
+        notes = self.player.render(4)
+        self.assertEqual([note["beat"] - start for note in notes], [1, 1, 1.5, 2, 3, 3, 3.5])
+        self.assertEqual([note["amp"] for note in notes], [1, 1, 1, 0.5, 0.5, 0.5, 0.5])
+        del self.sent[:]
+        Clock.step(3.75)
+        sent = read_notes(self.sent, "pluck")
+        self.assertEqual(len(sent), len(notes))
+        for key in ("midinote", "amp", "pan"):
+            self.assertEqual([note[key] for note in notes], [note[key] for note in sent])
+
+
+class TestKeyTimeline(PlayerClockTestCase):
+
+    def setUp(self):
+        PlayerClockTestCase.setUp(self)
+        self.p1, self.p2 = Player("test_timeline_1"), Player("test_timeline_2")
+        self.p1 >> pluck([0, 1, 2, 3], delay=0.5)
+        self.p2 >> pluck(self.p1.degree + 2)
+        self.start(self.p1)
+
+    def test_delayed_updates(self):
+        """ Keys are updated from a delayed event when the clock reaches it """
+        self.assertEqual(len(self.p1.key_timeline), 1)
+        self.assertEqual(self.p1.key_timeline[0][0], Clock.now() + 0.5)
+        Clock.step(1)
+        self.assertEqual(self.p1.degree.now(), 0)
+        Clock.step(0.5)
+        self.assertEqual(self.p1.degree.now(), 1)
+        self.assertEqual(len(self.p1.key_timeline), 0)
+
+    def test_not_applied_by_preview(self):
+        """ Previewing a player that follows a delayed player doesn't apply its updates early """
+        Clock.step(1)
+        notes = self.p2.events(4)
+        self.assertEqual([note["degree"] for note in notes], [2, 2, 2, 2])
+        self.assertEqual(len(self.p1.key_timeline), 1)
+        self.assertEqual(self.p1.degree.now(), 0)
+        Clock.step(0.5)
+        self.assertEqual(self.p1.degree.now(), 1)
+
+
+class TestEvery(PlayerClockTestCase):
+
+    def setUp(self):
+        PlayerClockTestCase.setUp(self)
+        self.player = Player("test_every")
+        self.player >> pluck([0, 1, 2, 3])
+        self.player.every(4, "degree.reverse")
+        self.call = self.player.repeat_events["degree.reverse"]
+
+    def test_not_scheduled_twice(self):
+        """ Calling `every` again while the method call is due doesn't schedule it twice """
+        items = Clock.wheel.pop(self.call.get_next())
+        self.assertTrue(self.call.isScheduled())
+        self.player.every(4, "degree.reverse")
+        for obj, args, kwargs in items:
+            obj(*args, **kwargs)
+        self.assertEqual(Clock.wheel.objects[self.call], 1)
+
+    def test_stopped(self):
+        """ A stopped method call is no longer scheduled once it is called """
+        items = Clock.wheel.pop(self.call.get_next())
+        self.call.stop()
+        for obj, args, kwargs in items:
+            obj(*args, **kwargs)
+        self.assertFalse(self.call.isScheduled())
+
+
+class TestVoiceManager(unittest.TestCase):
+
+    def setUp(self):
+        self.voices = VoiceManager(Clock)
+        self.p1, self.p2 = Player("test_voices_1"), Player("test_voices_2")
+
+    def test_steal(self):
+        """ The oldest note is stolen, for the player at its limit or from any player at
+            the total limit, and notes that have finished are not counted """
+        self.voices.set_limit(total=3, player=2)
+        self.assertEqual(self.voices.add(self.p1, 0, 10.0, 1.0, 1), [])
+        self.assertEqual(self.voices.add(self.p1, 1, 10.5, 1.0, 2), [])
+        self.assertEqual(self.voices.add(self.p1, 2, 11.0, 1.0, 3), [(1, 11.0)])
+        self.assertEqual(self.voices.add(self.p2, 0, 11.0, 1.0, 4), [])
+        self.assertEqual(self.voices.add(self.p2, 1, 11.2, 1.0, 5), [(2, 11.2)])
+        self.assertEqual(self.voices.add(self.p2, 2, 20.0, 1.0, 6), [])
+        self.assertEqual(self.voices.stats()["active"], 1)
+        self.assertEqual(self.voices.stats()["stolen"], 2)
+
+    def test_drop(self):
+        """ New notes are dropped at a player's own limit and cancelled notes are not counted """
+        self.voices.set_limit(policy="drop")
+        self.p1.max_voices = 1
+        self.assertEqual(self.voices.add(self.p1, 0, 10.0, 4.0, 1), [])
+        self.assertIsNone(self.voices.add(self.p1, 1, 11.0, 4.0, 2))
+        self.voices.cancel(self.p1, 0)
+        self.assertEqual(self.voices.add(self.p1, 0, 11.0, 4.0, 3), [])
+        self.assertEqual(self.voices.stats()["dropped"], 1)
+
+    def test_steal_first_started(self):
+        """ The note with the earliest start is stolen, and a note that hasn't started
+            when the new note starts is freed when it starts """
+        self.voices.set_limit(player=2)
+        self.assertEqual(self.voices.add(self.p1, 0, 10.5, 1.0, 1), [])
+        self.assertEqual(self.voices.add(self.p1, 1, 10.2, 1.0, 2), [])
+        self.assertEqual(self.voices.add(self.p1, 2, 10.4, 1.0, 3), [(2, 10.4)])
+        self.assertEqual(self.voices.add(self.p1, 3, 10.3, 1.0, 4), [(3, 10.4)])
+
+    def test_cancel_restores_stolen(self):
+        """ Notes stolen by a cancelled note are counted again """
+        self.voices.set_limit(total=2)
+        self.voices.add(self.p1, 0, 10.0, 4.0, 1)
+        self.voices.add(self.p2, 0, 10.5, 4.0, 2)
+        self.assertEqual(self.voices.add(self.p1, 1, 11.0, 4.0, 3), [(1, 11.0)])
+        self.assertEqual(self.voices.add(self.p1, 2, 11.5, 4.0, 4), [(2, 11.5)])
+        self.voices.cancel(self.p1, 2)
+        self.assertEqual(self.voices.stats()["players"], {str(self.p1): 1, str(self.p2): 1})
+        self.assertEqual(self.voices.stats()["stolen"], 1)
+        self.voices.cancel(self.p1, 1)
+        self.assertEqual(self.voices.stats()["players"], {str(self.p1): 1, str(self.p2): 1})
+        self.assertEqual(self.voices.stats()["stolen"], 0)
+        self.assertEqual(self.voices.add(self.p1, 1, 12.0, 4.0, 5), [(1, 12.0)])
+
+    def test_players_forgotten(self):
+        """ Players are forgotten when none of their notes are playing """
+        self.voices.set_limit(total=1)
+        self.voices.add(self.p1, 0, 10.0, 1.0, 1)
+        self.voices.add(self.p2, 0, 10.5, 1.0, 2)
+        self.assertEqual(list(self.voices.players), [self.p2])
+        self.voices.add(self.p1, 1, 20.0, 1.0, 3)
+        self.assertEqual(list(self.voices.players), [self.p1])
+        self.assertEqual(list(self.voices.counts), [self.p1])
+
+
+class TestVoiceLimit(PlayerClockTestCase):
+
+    def setUp(self):
+        PlayerClockTestCase.setUp(self)
+        self.addCleanup(Clock.set_voice_limit)
+        self.addCleanup(Clock.voices.reset)
+
+    def test_stolen_groups_freed(self):
+        """ Each note stolen from a player at its limit is freed when the new note starts """
+        Clock.set_voice_limit(player=1)
+        player = Player("test_voice_limit")
+        player >> pluck([0, 1, 2], sus=4)
+        self.start(player)
+        Clock.step(2)
+        groups, freed = [], []
+        for bundle in self.sent:
+            for address, args in read_osc(bundle.getBinary()):
+                if address == "/g_new":
+                    groups.append(args[0])
+                elif address == "/n_free":
+                    freed.append(args[0])
+        self.assertEqual(len(groups), 3)
+        self.assertEqual(freed, groups[:2])
+
+    def test_stopped_player_forgotten(self):
+        """ A player that has been stopped is forgotten once its notes have finished """
+        Clock.set_voice_limit(total=8)
+        player = Player("test_voice_stop")
+        player >> pluck([0, 1, 2], sus=2)
+        self.start(player)
+        Clock.step(1)
+        player.stop()
+        self.assertIn(player, Clock.voices.players)
+        Clock.step(4)
+        self.assertEqual(Clock.voices.active(), 0)
+        self.assertNotIn(player, Clock.voices.players)
+        self.assertNotIn(player, Clock.voices.counts)
+
+
+if __name__ == "__main__":
+    unittest.main()
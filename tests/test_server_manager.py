@@ -0,0 +1,27 @@
+""" Tests for writing OSC messages for the server """
+import struct
+import unittest
+
+from FoxDot.lib.ServerManager import NRTScore, OSCBundle, OSCMessage
+
+
+class TestNRTScore(unittest.TestCase):
+
+    def test_score_times(self):
+        """ Bundles are written in time order with timetags relative to the start time """
+        score = NRTScore(start_time=100)
+        for timetag in (102.5, 101.25):
+            bundle = OSCBundle(time=timetag)
+            bundle.append(OSCMessage("/s_new"))
+            score.sendOSC(bundle)
+        data, times = score.getBinary(duration=4), []
+        while data:
+            size = struct.unpack(">i", data[:4])[0]
+            secs, fract = struct.unpack(">LL", data[12:20])
+            times.append(secs + fract / 2.0 ** 32)
+            data = data[4 + size:]
+        self.assertEqual(times, [1.25, 2.5, 4])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,571 @@
+""" Tests for the TempoClock queue """
+import math
+import struct
+import sys
+import threading
+import time
+import unittest
+
+from FoxDot.lib.TempoClock import TempoClock, ManualTime, Queue, QueueBlock, BlockExecutor, BundlePacker, BundleSender, CallableInfo, History, BlockStats, Profiler, TimerWheel, TempoMap
+from FoxDot.lib.ServerManager import OSCBundle, OSCMessage
+from FoxDot.lib import Clock, Player, pluck
+
+
+class DummyClock(object):
+    server = None
+    def bar_length(self):
+        return 4
+
+
+def func_a():
+    return
+
+def func_b():
+    return
+
+
+class TestQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = Queue(DummyClock())
+
+    def test_pop_in_beat_order(self):
+        """ Blocks are popped earliest beat first regardless of insertion order """
+        for beat in (8, 2, 4, 1.5):
+            self.queue.add(func_a, beat)
+        beats = [self.queue.pop().beat for n in range(len(self.queue))]
+        self.assertEqual(beats, [1.5, 2, 4, 8])
+
+    def test_same_beat_merged(self):
+        """ Objects scheduled at the same beat share a block """
+        self.queue.add(func_a, 4)
+        self.queue.add(func_b, 4.0)
+        self.assertEqual(len(self.queue), 1)
+        block = self.queue.pop()
+        self.assertIsInstance(block, QueueBlock)
+        self.assertEqual(block.objects(), [func_a, func_b])
+
+    def test_next_event(self):
+        """ before_next_event / after_next_event compare against the earliest block """
+        self.assertTrue(self.queue.before_next_event(100))
+        self.assertFalse(self.queue.after_next_event(100))
+        self.queue.add(func_a, 4)
+        self.queue.add(func_a, 2)
+        self.assertTrue(self.queue.before_next_event(1))
+        self.assertTrue(self.queue.after_next_event(2))
+        self.assertEqual(self.queue.next(), 2)
+
+    def test_clear(self):
+        self.queue.add(func_a, 1)
+        self.queue.clear()
+        self.assertEqual(len(self.queue), 0)
+        self.assertEqual(self.queue.pop(), [])
+
+    def test_invalid_kwargs_removed(self):
+        """ Keywords the callable does not accept are not passed to it """
+        def func(a=0):
+            return
+        kwargs = {"a": 1, "b": 2}
+        self.queue.add(func, 1, kwargs=kwargs)
+        item = self.queue.pop().all_items()[0]
+        self.assertEqual(item.kwargs, {"a": 1})
+        self.assertEqual(kwargs, {"a": 1, "b": 2})
+
+
+class TestTimerWheel(unittest.TestCase):
+
+    def test_pop_in_beat_order(self):
+        """ Objects are returned in beat order, including beats far in the future """
+        wheel = TimerWheel(resolution=4, bits=2, levels=2)
+        for beat in (500.5, 3, 0.25, 3, 64):
+            wheel.add(beat, beat)
+        popped = []
+        while len(wheel):
+            beat = wheel.next()
+            popped.append([obj for obj, args, kwargs in wheel.pop(beat)])
+        self.assertEqual(popped, [[0.25], [3, 3], [64], [500.5]])
+
+    def test_items(self):
+        wheel = TimerWheel(resolution=4, bits=2, levels=2)
+        for beat in (500.5, 3, 0.25):
+            wheel.add(func_a, beat, (beat,))
+        wheel.pop(1)
+        self.assertEqual(wheel.items(), [(3, func_a, (3,), {}), (500.5, func_a, (500.5,), {})])
+
+    def test_contains(self):
+        """ Popped objects count as scheduled until they are added again or done """
+        wheel = TimerWheel()
+        wheel.add(func_a, 10)
+        self.assertIn(func_a, wheel)
+        wheel.pop(10)
+        self.assertIn(func_a, wheel)
+        wheel.add(func_a, 20)
+        self.assertEqual(wheel.objects[func_a], 1)
+        wheel.pop(20)
+        wheel.done(func_a)
+        self.assertNotIn(func_a, wheel)
+
+
+class TestTempoMap(unittest.TestCase):
+
+    def test_constant_segments(self):
+        """ 4 beats at 120bpm then 4 beats at 60bpm, repeating """
+        tempo_map = TempoMap([120, 60, 120], [4, 4])
+        self.assertAlmostEqual(tempo_map.get_seconds(4), 2)
+        self.assertAlmostEqual(tempo_map.get_seconds(6), 4)
+        self.assertAlmostEqual(tempo_map.get_seconds(12), 8)
+        self.assertAlmostEqual(tempo_map.get_beat(7), 10)
+
+    def test_ramp(self):
+        """ Converting beats to seconds and back on a tempo ramp returns the same beat """
+        tempo_map = TempoMap([60, 120, 60], [8, 8], ramp=True)
+        self.assertAlmostEqual(tempo_map.get_seconds(8), 60 * 8 * math.log(2) / 60)
+        self.assertAlmostEqual(tempo_map.get_bpm(4), 90)
+        for beat in (0.5, 3, 9.25, 40):
+            self.assertAlmostEqual(tempo_map.get_beat(tempo_map.get_seconds(beat)), beat)
+
+
+class TestCallableInfo(unittest.TestCase):
+
+    def test_cached_by_code(self):
+        """ Functions sharing code share an entry, redefined functions don't """
+        make = lambda: (lambda a=0: a)
+        self.assertIs(CallableInfo.get(make()), CallableInfo.get(make()))
+        def func(a=0):
+            return
+        old = CallableInfo.get(func)
+        def func(b=0, **kwargs):
+            return
+        new = CallableInfo.get(func)
+        self.assertIsNot(old, new)
+        self.assertEqual(old.args, frozenset(["a"]))
+        self.assertTrue(new.keywords)
+
+    def test_priority(self):
+        class Callable(object):
+            def __call__(self):
+                return
+        self.assertEqual(CallableInfo.get(func_a).priority, 0)
+        self.assertEqual(CallableInfo.get(Callable()).priority, 3)
+
+
+class TestBlockExecutor(unittest.TestCase):
+
+    def test_blocks_called_in_order(self):
+        """ A single worker calls blocks in the order they were submitted """
+        called = []
+        done = threading.Event()
+        def func(block, beat, dispatched):
+            called.append(block)
+            if len(called) == 5:
+                done.set()
+        executor = BlockExecutor(func, workers=1)
+        executor.start()
+        for n in range(5):
+            executor.submit(n, n)
+        self.assertTrue(done.wait(2))
+        executor.shutdown()
+        self.assertEqual(called, [0, 1, 2, 3, 4])
+        stats = executor.stats()
+        self.assertEqual(stats["submitted"], 5)
+        self.assertEqual(stats["completed"], 5)
+        self.assertEqual(stats["workers"], 0)
+
+    def test_set_workers(self):
+        executor = BlockExecutor(lambda *args: None, workers=1)
+        executor.start()
+        executor.set_workers(3)
+        self.assertEqual(executor.stats()["workers"], 3)
+        executor.shutdown()
+
+    def test_in_flight(self):
+        """ Blocks waiting for and being called by workers are counted as in flight """
+        release = threading.Event()
+        started = threading.Event()
+        def func(block, beat, dispatched):
+            started.set()
+            release.wait(2)
+        executor = BlockExecutor(func, workers=1)
+        executor.start()
+        for n in range(3):
+            executor.submit(n, n)
+        self.assertTrue(started.wait(2))
+        self.assertEqual(executor.in_flight(), 3)
+        self.assertEqual(executor.stats()["running"], 1)
+        release.set()
+        executor.shutdown()
+        self.assertEqual(executor.stats()["max_running"], 1)
+
+
+class TestDeadlineLoop(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = TempoClock(bpm=120)
+        self.clock.max_sleep_time = 10
+        self.clock.start()
+        self.addCleanup(self.clock.stop)
+
+    def test_woken_by_schedule(self):
+        """ Scheduling a block before the one the clock is waiting for wakes it up """
+        called = threading.Event()
+        self.clock.schedule(lambda: None, self.clock.now() + 100)
+        time.sleep(0.05)
+        start = time.time()
+        self.clock.schedule(called.set, self.clock.now() + 0.1)
+        self.assertTrue(called.wait(2))
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(self.clock.clock_stats()["mode"], "deadline")
+
+    def test_polling(self):
+        """ Polling can be turned on and off while the clock is running """
+        called = threading.Event()
+        self.clock.set_polling(True)
+        self.clock.schedule(called.set, self.clock.now() + 0.1)
+        self.assertTrue(called.wait(2))
+        self.assertEqual(self.clock.clock_stats()["mode"], "polling")
+        called.clear()
+        self.clock.set_polling(False)
+        self.clock.schedule(called.set, self.clock.now() + 0.1)
+        self.assertTrue(called.wait(2))
+
+
+class TestManualTime(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = TempoClock(bpm=120)
+        self.clock.set_time_source(ManualTime(1000))
+
+    def test_step(self):
+        """ Stepping calls the blocks due on the way, in order and at their exact times """
+        called = []
+        def func(beat):
+            called.append((beat, self.clock.now(), self.clock.get_machine_time()))
+        for beat in (3, 1, 2.5):
+            self.clock.schedule(func, beat, args=(beat,))
+        self.assertEqual(self.clock.step(2), 1)
+        self.assertEqual(self.clock.step(2), 2)
+        self.assertEqual([item[0] for item in called], [1, 2.5, 3])
+        for beat, now, machine_time in called:
+            self.assertAlmostEqual(now, beat)
+            self.assertAlmostEqual(machine_time, 1000 + beat / 2)
+        self.assertAlmostEqual(self.clock.get_machine_time(), 1002)
+        self.assertLess(self.clock.stats()["max_lateness"], 1e-6)
+
+    def test_shift(self):
+        """ Shifting the clock moves scheduled functions and timers by the same number of beats """
+        called = []
+        self.clock.schedule(lambda: called.append(("schedule", self.clock.now())), 2)
+        self.clock.schedule_timer(lambda: called.append(("timer", self.clock.now())), 2.5)
+        self.clock.shift(1)
+        self.clock.step(4)
+        self.assertEqual([item[0] for item in called], ["schedule", "timer"])
+        self.assertAlmostEqual(called[0][1], 3)
+        self.assertAlmostEqual(called[1][1], 3.5)
+
+    def test_executor_uses_time_source(self):
+        """ Blocks handed to the workers are timed using the clock's time source """
+        dispatched = []
+        done = threading.Event()
+        def func(block, beat, time):
+            dispatched.append(time)
+            done.set()
+        executor = BlockExecutor(func, timer=self.clock.get_machine_time)
+        executor.start()
+        executor.submit(0, 0)
+        self.assertTrue(done.wait(2))
+        executor.shutdown()
+        self.assertEqual(dispatched, [1000])
+        self.assertEqual(executor.stats()["max_wait"], 0)
+
+
+class DummyBundle(object):
+    address = None
+    def __init__(self, timetag):
+        self.timetag = timetag
+
+
+class ServerStub(object):
+    """ Calls `func` with each OSC bundle sent to it and passes anything else on to `server` """
+    def __init__(self, func, server=None):
+        self.func = func
+        self.server = server
+    def __getattr__(self, attr):
+        return getattr(self.server, attr)
+    def sendOSC(self, bundle):
+        self.func(bundle)
+
+
+class PlayerClockTestCase(unittest.TestCase):
+    """ Plays players on FoxDot's clock using a `ManualTime` source and stores the bundles
+        sent to the server in `self.sent`. Time starts at 0 so that beats are converted to
+        and from seconds without the rounding errors of times since the epoch """
+
+    def setUp(self):
+        self.sent = []
+        self.server, self.time_source = Clock.server, Clock.time_source
+        Clock.clear()
+        Clock.set_time_source(ManualTime(0))
+        Clock.server = ServerStub(self.sent.append, self.server)
+
+    def tearDown(self):
+        Clock.clear()
+        Clock.server = self.server
+        Clock.set_time_source(self.time_source)
+        Clock.start()
+
+    def start(self, player):
+        """ Moves the clock on to the start of `player`'s first event """
+        Clock.step(player.event_index - Clock.now())
+
+
+class TestBundleSender(unittest.TestCase):
+
+    def setUp(self):
+        clock = DummyClock()
+        clock.latency = 0.1
+        self.sender = BundleSender(clock)
+
+    def test_cancel(self):
+        """ Only the cancelled player's bundles are removed and the earliest event is returned """
+        player, other = object(), object()
+        self.sender.add(DummyBundle(10), (player, 5, 2.5))
+        self.sender.add(DummyBundle(9), (player, 4, 2.0))
+        self.sender.add(DummyBundle(9.5), (other, 1, 2.0))
+        self.sender.add(DummyBundle(8), None)
+        self.assertEqual(self.sender.cancel(player), (4, 2.0))
+        self.assertEqual(len(self.sender), 2)
+        self.assertEqual(self.sender.heap[0][0], 8 - 0.1)
+        self.assertIsNone(self.sender.cancel(player))
+
+    def test_restarted_with_clock(self):
+        """ Starting a clock in lookahead mode again after stopping it starts the sending thread """
+        sent = threading.Event()
+        clock = TempoClock()
+        clock.server = ServerStub(lambda bundle: sent.set())
+        clock.set_lookahead(0.1)
+        clock.stop()
+        clock.start()
+        clock.sender.add(DummyBundle(clock.get_machine_time() + clock.latency))
+        self.assertTrue(sent.wait(2))
+        clock.stop()
+
+
+def read_bundle(data):
+    """ Returns the timetag of a binary OSC bundle, in seconds since the epoch, and a list of
+        its contents, which are either nested bundles or the last int argument of a message """
+    if not data.startswith(b"#bundle"):
+        return struct.unpack(">i", data[-4:])[0]
+    secs, fract = struct.unpack(">LL", data[8:16])
+    items, data = [], data[16:]
+    while data:
+        size = struct.unpack(">i", data[:4])[0]
+        items.append(read_bundle(data[4:4 + size]))
+        data = data[4 + size:]
+    return (secs - 2208988800 + fract / 2.0 ** 32, items)
+
+
+class TestBundlePacker(unittest.TestCase):
+
+    def note(self, timetag, node):
+        bundle = OSCBundle(time=timetag)
+        message = OSCMessage("/s_new")
+        message.append(["pluck", node])
+        bundle.append(message)
+        return bundle
+
+    def test_pack(self):
+        """ Notes with the same timetag are merged, delayed notes are nested with their own
+            timetag, and datagrams are split at the bundle size """
+        notes = [self.note(10, 1), self.note(10.5, 2), self.note(10, 3)]
+        packed = BundlePacker(1472).pack(notes)
+        self.assertEqual(len(packed), 1)
+        self.assertEqual(read_bundle(packed[0].getBinary()), (10, [(10, [1, 3]), (10.5, [2])]))
+        size = 16 + 2 * (len(notes[0].getBinary()) + 4)
+        packed = BundlePacker(size).pack(notes * 3)
+        self.assertEqual(len(packed), 5)
+        self.assertTrue(all(len(bundle.getBinary()) <= size for bundle in packed))
+
+
+class TestBlockStats(unittest.TestCase):
+
+    def test_lateness_histogram(self):
+        """ Blocks are counted in the first bin their lateness fits in and can be reset """
+        stats = BlockStats()
+        for lateness in (-0.01, 0.0005, 0.02, 1.0):
+            stats.add_block(lateness, 0.001, 2)
+        stats.add_dropped()
+        data = stats.stats()
+        self.assertEqual(list(data["lateness"].values()), [2, 0, 0, 1, 0, 0, 0, 1])
+        self.assertEqual(data["max_lateness"], 1.0)
+        self.assertEqual(data["dropped_bundles"], 1)
+        stats.reset()
+        self.assertEqual(stats.stats()["blocks"], 0)
+
+    def test_late_blocks(self):
+        """ Actions taken by the late policy are counted by name """
+        stats = BlockStats()
+        for action in ("coalesced", "coalesced", "catch_up_passes"):
+            stats.add_late(action)
+        self.assertEqual(stats.stats()["late_blocks"], {"coalesced": 2, "catch_up_passes": 1})
+
+
+class TestProfiler(unittest.TestCase):
+
+    def test_top_items(self):
+        """ Items are ordered by total time and only the last `bars` bars are kept """
+        profiler = Profiler(DummyClock(), bars=2)
+        profiler.add(func_a, 0, 10.0)
+        for beat in range(4, 12):
+            profiler.add(func_a, beat, 0.1)
+            profiler.add(func_b, beat, 0.2)
+        top = profiler.top()
+        self.assertEqual([item[0] for item in top], ["func_b", "func_a"])
+        self.assertEqual(top[1][1], 8)
+        self.assertEqual(len(profiler.top(1, bars=1)), 1)
+
+
+class TestHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.history = History(max_beats=4)
+        for beat in range(8):
+            bundle = OSCBundle(time=beat + 10.5)
+            bundle.append(OSCMessage("/s_new"))
+            self.history.add(beat, beat + 10, [bundle])
+
+    def test_oldest_beats_removed(self):
+        """ Only the last `max_beats` beats are kept """
+        self.assertEqual(self.history.beats(0, 8), [3, 4, 5, 6, 7])
+        self.assertFalse(self.history.covers(2))
+        self.assertTrue(self.history.covers(3))
+
+    def test_get_bundles(self):
+        """ Stored bundles are re-timed relative to a new time """
+        bundle = self.history.get_bundles(5, 100)[0]
+        self.assertEqual(bundle.timetag, 100.5)
+        self.assertEqual(len(self.history.get_bundles(1, 100)), 0)
+
+
+class TestLatePolicy(PlayerClockTestCase):
+
+    def setUp(self):
+        PlayerClockTestCase.setUp(self)
+        self.addCleanup(Clock.set_late_policy)
+        self.player = Player("test_late")
+        self.player >> pluck([0, 1], dur=0.5)
+        self.start(self.player)
+
+    def stall(self, policy, beats=4):
+        """ Plays for most of a bar and then moves the time on by `beats` without calling any
+            blocks, as if Python had stalled, so that the player's next 8 events are late """
+        Clock.set_late_policy(policy, threshold=0.1)
+        Clock.step(3.75)
+        Clock.time_source.step(Clock.beat_dur(beats))
+        Clock.reset_stats()
+        del self.sent[:]
+        self.event_n = self.player.event_n
+        Clock.step(0)
+        self.assertEqual(self.player.event_n - self.event_n, 8)
+        return Clock.stats()["late_blocks"]
+
+    def test_drop(self):
+        """ Late blocks are called without sending their messages """
+        self.assertEqual(self.stall("drop"), {"dropped": 8})
+        self.assertEqual(self.sent, [])
+
+    def test_coalesce(self):
+        """ The late blocks are called in one pass without sending their messages """
+        self.assertEqual(self.stall("coalesce"), {"coalesced": 8, "catch_up_passes": 1})
+        self.assertEqual(self.sent, [])
+        self.assertFalse(Clock.catching_up)
+
+    def test_compress(self):
+        """ Late blocks are sent from `latency` seconds after now, closer together """
+        self.assertEqual(self.stall("compress"), {"compressed": 8})
+        times = [bundle.timetag for bundle in self.sent]
+        self.assertAlmostEqual(times[0], Clock.get_machine_time() + Clock.latency)
+        for a, b in zip(times, times[1:]):
+            self.assertAlmostEqual(b - a, Clock.beat_dur(0.5) * 0.25)
+
+
+class TestCoalesceThread(unittest.TestCase):
+
+    def test_called_by_worker(self):
+        """ The overdue blocks are called in order by a worker thread, not the clock thread """
+        clock = TempoClock()
+        clock.set_late_policy("coalesce")
+        called = []
+        done = threading.Event()
+        def func(beat):
+            called.append((beat, threading.current_thread()))
+            if beat > 0:
+                done.set()
+        for beat in (-1, -2, 0.25, -1.5):
+            clock.schedule(func, clock.now() + beat, args=(beat,))
+        clock.start()
+        self.assertTrue(done.wait(2))
+        clock.stop()
+        self.assertEqual([beat for beat, thread in called], [-2, -1.5, -1, 0.25])
+        self.assertNotIn(clock.thread, [thread for beat, thread in called])
+        self.assertEqual(clock.stats()["late_blocks"], {"coalesced": 3, "catch_up_passes": 1})
+
+    def test_overload_called_by_worker(self):
+        """ Blocks made late by the "late" overload action are coalesced on a worker too """
+        clock = TempoClock()
+        clock.set_late_policy("coalesce")
+        clock.set_max_blocks(1, "late")
+        release, done = threading.Event(), threading.Event()
+        called = []
+        def hold():
+            release.wait(2)
+        def func():
+            called.append(threading.current_thread())
+            done.set()
+        start = clock.now()
+        clock.schedule(hold, start + 0.1)
+        clock.schedule(func, start + 0.2)
+        clock.start()
+        time.sleep(clock.beat_dur(0.4))
+        release.set()
+        self.assertTrue(done.wait(2))
+        clock.stop()
+        self.assertNotIn(clock.thread, called)
+        self.assertEqual(clock.stats()["late_blocks"].get("coalesced"), 1)
+
+
+class TestHistoryReplay(PlayerClockTestCase):
+
+    def test_rewind_twice(self):
+        """ Moving the clock back over the same beats again replays the same bundles """
+        player = Player("test_history")
+        player >> pluck([0, 1, 2, 3])
+        self.start(player)
+        Clock.step(8)
+        replayed = []
+        for n in range(2):
+            del self.sent[:]
+            Clock.set_time(Clock.now() - 4.25)
+            Clock.step(3.5)
+            replayed.append(len(self.sent))
+        self.assertEqual(replayed, [4, 4])
+
+
+@unittest.skipIf(sys.version_info < (3, 7), "requires asyncio.get_running_loop")
+class TestAsyncTempoClock(unittest.TestCase):
+
+    def test_blocks_called_on_loop(self):
+        """ Scheduled items are called on the event loop without another thread """
+        import asyncio
+        from FoxDot.lib.AsyncTempoClock import AsyncTempoClock
+        called = []
+        async def main():
+            clock = AsyncTempoClock(bpm=600, loop=asyncio.get_running_loop())
+            clock.schedule(lambda: called.append(threading.current_thread()), clock.now() + 1)
+            await asyncio.sleep(0.3)
+            clock.stop()
+        asyncio.run(main())
+        self.assertEqual(called, [threading.current_thread()])
+
+
+if __name__ == "__main__":
+    unittest.main()